@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+'''
+*********************************************************
+Copyright @ 2015 EMC Corporation All Rights Reserved
+*********************************************************
+
+Compare GET and GETNEXT latency of the legacy padded text OID layout with
+the encoded, indexed OID key column, the same queries variation/sql.py runs.
+
+    python benchmarks/bench_oid_key.py [gets] [walk steps]
+'''
+import sys
+import random
+import sqlite3
+import benchutil
+import pdusim.snmprecdb as snmprecdb
+import pdusim.common.oidkey as oidkey
+
+
+def all_oids(db_file):
+    conn = sqlite3.connect(db_file)
+    oids = [oidkey.from_sql_oid(row[0]) for row in
+            conn.execute('select oid from snmprec order by oid')]
+    conn.close()
+    return oids
+
+
+def legacy_get(conn, oid):
+    return conn.execute('select tag, value from snmprec where oid=\'%s\' '
+                        'limit 1' % oidkey.to_sql_oid(oid)).fetchone()
+
+
+def legacy_next(conn, oid):
+    row = conn.execute('select oid from snmprec where oid>\'%s\' '
+                       'order by oid limit 1' %
+                       oidkey.to_sql_oid(oid)).fetchone()
+    if row:
+        return oidkey.from_sql_oid(row[0])
+
+
+def key_get(conn, oid):
+    return conn.execute('select tag, value from snmprec where okey=? '
+                        'limit 1', (snmprecdb.key_param(oid),)).fetchone()
+
+
+def key_next(conn, oid):
+    row = conn.execute('select okey from snmprec where okey>? '
+                       'order by okey limit 1',
+                       (snmprecdb.key_param(oid),)).fetchone()
+    if row:
+        return oidkey.decode(bytes(row[0]))
+
+
+def gets(conn, get, oids):
+    def run(ops):
+        for i in range(ops):
+            get(conn, oids[i % len(oids)])
+    return run
+
+
+def walk(conn, get, next_oid):
+    def run(ops):
+        oid = "1.3.6"
+        for _ in range(ops):
+            oid = next_oid(conn, oid)
+            if oid is None:
+                oid = "1.3.6"
+                continue
+            get(conn, oid)
+    return run
+
+
+def main():
+    get_ops = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    walk_ops = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+
+    legacy_db = benchutil.copy_db(benchutil.hawk_db)
+    key_db = benchutil.copy_db(benchutil.hawk_db)
+    try:
+        snmprecdb.upgrade(key_db)
+        oids = all_oids(legacy_db)
+        random.seed(0)
+        random.shuffle(oids)
+
+        legacy_conn = sqlite3.connect(legacy_db)
+        key_conn = sqlite3.connect(key_db)
+
+        before = benchutil.measure("GET, padded text oid", get_ops,
+                                   gets(legacy_conn, legacy_get, oids))
+        after = benchutil.measure("GET, encoded oid key", get_ops,
+                                  gets(key_conn, key_get, oids))
+        benchutil.report_speedup(before, after)
+
+        before = benchutil.measure("walk, padded text oid", walk_ops,
+                                   walk(legacy_conn, legacy_get, legacy_next))
+        after = benchutil.measure("walk, encoded oid key", walk_ops,
+                                  walk(key_conn, key_get, key_next))
+        benchutil.report_speedup(before, after)
+
+        legacy_conn.close()
+        key_conn.close()
+    finally:
+        benchutil.remove_db(legacy_db)
+        benchutil.remove_db(key_db)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+'''
+*********************************************************
+Copyright @ 2015 EMC Corporation All Rights Reserved
+*********************************************************
+
+Walk the whole Hawk database through variate() of variation/sql.py, the
+way snmpsimd serves an snmpwalk, and compare it with the former per-request
+work of the module: a new cursor, the failing isolation level statement,
+the padded text OID formatted into two statements and the value parsed and
+printed for every GETNEXT.
+
+Needs snmpsim and pysnmp, like snmpsimd does.
+
+    python benchmarks/bench_sql_variation.py [walks]
+'''
+import os
+import sys
+import imp
+import sqlite3
+import benchutil
+import pdusim.snmprecdb as snmprecdb
+import pdusim.common.oidkey as oidkey
+from pysnmp.proto import rfc1902
+from snmpsim.mltsplit import split
+
+sql = imp.load_source("sql", os.path.join(benchutil.repo_dir,
+                                          "variation", "sql.py"))
+
+ERROR_STATUS = object()
+
+
+def legacy_next(conn, devnull, oid, value):
+    '''
+    GETNEXT as variate() ran it before
+    '''
+    cursor = conn.cursor()
+    try:
+        cursor.execute('set session transaction isolation level 1')
+        cursor.fetchall()
+    except Exception:
+        pass
+    table = value.split(',').pop(0)
+    cursor.execute('select oid from %s where oid>\'%s\' order by oid limit 1' %
+                   (table, oidkey.to_sql_oid(oid)))
+    resultset = cursor.fetchone()
+    if not resultset:
+        cursor.close()
+        return None
+    oid = oidkey.from_sql_oid(resultset[0])
+    cursor.execute('select tag, value from %s where oid=\'%s\' limit 1' %
+                   (table, oidkey.to_sql_oid(oid)))
+    resultset = cursor.fetchone()
+    cursor.close()
+    try:
+        value_settings = dict([split(x, '=') for x in
+                               split(resultset[1], ',')])
+        print >> devnull, value_settings
+    except Exception:
+        pass
+    return oid
+
+
+def legacy_walk(conn):
+    def run(walks):
+        with open(os.devnull, 'w') as devnull:
+            for _ in range(walks):
+                oid = "1.3.6"
+                while oid is not None:
+                    oid = legacy_next(conn, devnull, oid, "snmprec")
+    return run
+
+
+def variate_walk(walks):
+    for _ in range(walks):
+        oid = rfc1902.ObjectName("1.3.6")
+        while True:
+            oid, _, value = sql.variate(oid, "", "snmprec",
+                                        origOid=oid, setFlag=False,
+                                        nextFlag=True,
+                                        errorStatus=ERROR_STATUS)
+            if value is ERROR_STATUS:
+                break
+
+
+def variation_walk(db_file):
+    '''
+    Walk db_file with the variation module initialized as snmpsimd does
+    '''
+    def run(walks):
+        sql.init(options="dbtype:sqlite3,dboptions:" + db_file, mode="")
+        try:
+            variate_walk(walks)
+        finally:
+            sql.shutdown(mode="")
+    return run
+
+
+def main():
+    walks = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+
+    legacy_db = benchutil.copy_db(benchutil.hawk_db)
+    key_db = benchutil.copy_db(benchutil.hawk_db)
+
+    # init() opens the inform pipe for writing, which needs a reader
+    if not os.path.exists("/tmp/inform"):
+        os.mkfifo("/tmp/inform")
+    inform = os.open("/tmp/inform", os.O_RDONLY | os.O_NONBLOCK)
+    try:
+        snmprecdb.upgrade(key_db)
+        conn = sqlite3.connect(legacy_db)
+        rows = conn.execute("select count(*) from snmprec").fetchone()[0]
+        ops = walks * rows
+
+        before = benchutil.measure("walk, former variate", ops,
+                                   lambda ops: legacy_walk(conn)(walks))
+        conn.close()
+        after = benchutil.measure("walk, variate, padded text oid", ops,
+                                  lambda ops:
+                                  variation_walk(legacy_db)(walks))
+        benchutil.report_speedup(before, after)
+        after = benchutil.measure("walk, variate, encoded oid key", ops,
+                                  lambda ops: variation_walk(key_db)(walks))
+        benchutil.report_speedup(before, after)
+    finally:
+        os.close(inform)
+        benchutil.remove_db(legacy_db)
+        benchutil.remove_db(key_db)
+
+
+if __name__ == '__main__':
+    main()
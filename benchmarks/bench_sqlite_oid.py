@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+'''
+*********************************************************
+Copyright @ 2015 EMC Corporation All Rights Reserved
+*********************************************************
+
+Compare ops/sec of the former connect-per-call SQLite access with the pooled
+SqliteOIDHandler on a copy of the Hawk database.
+
+    python benchmarks/bench_sqlite_oid.py [ops]
+'''
+import sys
+import sqlite3
+import benchutil
+from pdusim.oid import SqliteOIDHandler
+
+
+def legacy_query(db_file, oid):
+    conn = sqlite3.connect(db_file)
+    cur = conn.cursor()
+    sql_oid = '.'.join(['%10s' % x for x in str(oid).split('.')])
+    cur.execute('select value from snmprec where oid=\'%s\'' % sql_oid)
+    resultset = cur.fetchone()
+    conn.close()
+    if resultset:
+        return resultset[0]
+
+
+def legacy_update(db_file, oid, val):
+    conn = sqlite3.connect(db_file)
+    cur = conn.cursor()
+    sql_oid = '.'.join(['%10s' % x for x in str(oid).split('.')])
+    cur.execute('update snmprec set value = \'%s\' where oid=\'%s\'' %
+                (val, sql_oid))
+    conn.commit()
+    conn.close()
+
+
+def outlet_storm(query, update):
+    '''
+    Read-modify-write every outlet, the pattern of an outlet storm.
+    '''
+    def run(ops):
+        for i in range(ops / 2):
+            oid = benchutil.hawk_outlet_oid.format(i % 24 + 1)
+            update(oid, query(oid))
+    return run
+
+
+def main():
+    ops = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    db_file = benchutil.copy_db(benchutil.hawk_db)
+    try:
+        before = benchutil.measure(
+            "connect per call",
+            ops,
+            outlet_storm(lambda oid: legacy_query(db_file, oid),
+                         lambda oid, val: legacy_update(db_file, oid, val)))
+
+        handler = SqliteOIDHandler(db_file, "snmprec")
+        after = benchutil.measure(
+            "pooled connection, WAL",
+            ops,
+            outlet_storm(handler.query_oid_val, handler.update_oid_val))
+        handler.close()
+
+        benchutil.report_speedup(before, after)
+    finally:
+        benchutil.remove_db(db_file)
+
+
+if __name__ == '__main__':
+    main()
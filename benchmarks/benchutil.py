@@ -0,0 +1,51 @@
+'''
+*********************************************************
+Copyright @ 2015 EMC Corporation All Rights Reserved
+*********************************************************
+'''
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repo_dir)
+
+hawk_db = os.path.join(repo_dir, "snmpdata", "hawk", "ipia.db")
+sentry_db = os.path.join(repo_dir, "snmpdata", "sentry", "sentry3.db")
+
+# A Hawk outlet control OID, pdu 1 outlet <n>
+hawk_outlet_oid = "1.3.6.1.4.1.3711.24.1.1.7.2.3.1.5.1.{0}"
+
+
+def copy_db(src):
+    '''
+    Copy a shipped database into a scratch directory so a benchmark never
+    modifies the tree.
+    '''
+    tmp_dir = tempfile.mkdtemp(prefix="vpdu-bench-")
+    dst = os.path.join(tmp_dir, os.path.basename(src))
+    shutil.copy(src, dst)
+    return dst
+
+
+def remove_db(path):
+    shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+
+
+def measure(name, ops, func):
+    '''
+    Run func(ops) and report operations per second.
+    '''
+    start = time.time()
+    func(ops)
+    elapsed = time.time() - start
+    rate = ops / elapsed if elapsed > 0 else float('inf')
+    print "{0:<40} {1:>8} ops {2:>9.3f} s {3:>12.1f} ops/s".\
+        format(name, ops, elapsed, rate)
+    return rate
+
+
+def report_speedup(before, after):
+    print "{0:<40} {1:>41.1f}x".format("speedup", after / before)
@@ -0,0 +1,110 @@
+#!/usr/bin/python
+
+'''
+*********************************************************
+Copyright @ 2015 EMC Corporation All Rights Reserved
+*********************************************************
+'''
+
+import sys
+import time
+import getopt
+import pdusim.snmprecdb as snmprecdb
+import pdusim.oidmmap as oidmmap
+
+
+def usage():
+    print("Usage: {} [OPTIONS] <command> <args>".format(sys.argv[0]))
+    print("Commands are:")
+    print("migrate <database>      Add the encoded OID key column and index")
+    print("compile <source> [<target>]")
+    print("                        Compile a database or .snmprec file into a")
+    print("                        memory-mapped OID table")
+    print("import <snmprec> <database>")
+    print("                        Load a .snmprec file into the snmprec table")
+    print("export <database> <snmprec>")
+    print("                        Write the snmprec table to a .snmprec file")
+    print("Options are:")
+    print("-t, --table=<name>      snmprec table name, default is snmprec")
+    print("-h                      Help")
+
+
+def command_migrate(args, table):
+    if len(args) != 1:
+        usage()
+        sys.exit(1)
+
+    if snmprecdb.upgrade(args[0], table):
+        print("{0} is upgraded.".format(args[0]))
+    else:
+        print("{0} is already up to date.".format(args[0]))
+
+
+def command_compile(args, table):
+    if len(args) not in (1, 2):
+        usage()
+        sys.exit(1)
+
+    source = args[0]
+    target = args[1] if len(args) == 2 else oidmmap.map_path(source)
+    if source.endswith(".snmprec"):
+        count = oidmmap.compile_snmprec(source, target)
+    else:
+        count = oidmmap.compile_sqlite(source, target, table)
+    print("Compiled {0} records into {1}.".format(count, target))
+
+
+def report_rate(action, count, start):
+    elapsed = time.time() - start
+    rate = count / elapsed if elapsed > 0 else 0
+    print("{0} {1} records in {2:.2f}s, {3:.0f} records/s.".
+          format(action, count, elapsed, rate))
+
+
+def command_import(args, table):
+    if len(args) != 2:
+        usage()
+        sys.exit(1)
+
+    start = time.time()
+    count = snmprecdb.import_snmprec(args[0], args[1], table)
+    report_rate("Imported", count, start)
+
+
+def command_export(args, table):
+    if len(args) != 2:
+        usage()
+        sys.exit(1)
+
+    start = time.time()
+    count = snmprecdb.export_snmprec(args[0], args[1], table)
+    report_rate("Exported", count, start)
+
+
+commands = {
+    "migrate": command_migrate,
+    "compile": command_compile,
+    "import": command_import,
+    "export": command_export
+}
+
+
+if __name__ == '__main__':
+    table = "snmprec"
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "ht:", ["help", "table="])
+        for opt, arg in opts:
+            if opt in ("-h", "--help"):
+                usage()
+                sys.exit(1)
+            elif opt in ("-t", "--table"):
+                table = arg
+    except getopt.GetoptError:
+        usage()
+        sys.exit(1)
+
+    if not args or args[0] not in commands:
+        usage()
+        sys.exit(1)
+
+    commands[args[0]](args[1:], table)
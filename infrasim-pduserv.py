@@ -30,6 +30,8 @@ import pdusim.common.config as config
 import pdusim.common.daemon
 import pdusim.mapping_file as mapping_file
 import pdusim.pdusim
+import pdusim.oidstats as oidstats
+import pdusim.sss as sss
 
 server_pid_file = "/var/run/pdusim/infrasim-pduserv.pid"
 SIOCGIFINDEX = 0x8933
@@ -499,12 +501,16 @@ class vPDUHandler(SSHHandler):
 
     @command(['vpdu'])
     def command_vpdu(self, params):
-        '''[<start/stop/restart/status>]
+        '''[<start/stop/restart/status/stats>]
         Control vpdu service and get vpdu service status.
         vpdu start   - Start vPDU and SNMP simulator service
         vpdu stop    - Stop vPDU and SNMP simulator service
         vpdu restart - Restart vPDU and SNMP simulator service
         vpdu status  - Get vPDU and SNMP simulator status
+        vpdu stats [<count>]
+                     - Show the most requested OID prefixes of the SNMP
+                       simulator, 20 if count is not given, with their
+                       latency in microseconds
         '''
         if len(params) == 0:
             return
@@ -568,6 +574,42 @@ class vPDUHandler(SSHHandler):
                                                             colors.NORMAL)
                     self.writeresponse(response)
                     logger.info(response)
+        elif params[0] == 'stats':
+            self.show_stats(int(params[1]) if len(params) > 1 else 20)
+
+    def show_stats(self, count):
+        stats = oidstats.load(sss.sql_stats_file)
+        if stats is None:
+            self.writeresponse("%sNo statistics found, they are written by "
+                               "dbtype sqlite and memory.%s" %
+                               (colors.RED, colors.NORMAL))
+            return
+
+        # OIDs are long, do not wrap them
+        table = Texttable(max_width=0)
+        table.header(["OID prefix", "GET", "GETNEXT", "SET",
+                      "avg", "p50", "p99"])
+        table.set_cols_dtype(['t', 'i', 'i', 'i', 'f', 't', 't'])
+        table.set_cols_align(['l', 'r', 'r', 'r', 'r', 'r', 'r'])
+        table.set_precision(1)
+
+        def bound(latency):
+            if latency is None:
+                return ">%d" % oidstats.BUCKETS[-1]
+            return "<=%d" % latency
+
+        for prefix, counts, average, p50, p99 in \
+                oidstats.hottest(stats, count):
+            table.add_row([prefix, counts["get"], counts["getnext"],
+                           counts["set"], average, bound(p50), bound(p99)])
+        self.writeresponse("Since {0}, written {1}".format(
+            time.ctime(stats["started"]), time.ctime(stats["time"])))
+        self.writeresponse(table.draw())
+        informs = stats.get("informs")
+        if informs:
+            self.writeresponse(
+                "Informs: {queued} queued, {sent} sent, {retries} retries, "
+                "{coalesced} coalesced, {dropped} dropped".format(**informs))
 
     @command(['password', 'pass'])
     def command_password(self, params):
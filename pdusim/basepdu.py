@@ -4,33 +4,46 @@ Copyright @ 2015 EMC Corporation All Rights Reserved
 *********************************************************
 '''
 
-import threading
-import Queue
 import common.logger as logger
+import common.channel as channel
+import oidrouter
+import workers
 from common.colors import bcolors as colors
 
 from abc import ABCMeta, abstractmethod
-import sys
 
 
-class vPDUBase(threading.Thread):
+class vPDUBase(object):
     '''
-    Base PDU class.
+    Base PDU class. The tasks run on the worker pool shared by all PDUs,
+    those of an outlet in order, see workers.py.
     '''
     __metaclass__ = ABCMeta
 
-    def __init__(self, oid_handler):
+    def __init__(self, oid_handler, pool=None):
         super(vPDUBase, self).__init__()
-        self.__tasks_queue = Queue.Queue()
+        self.__pool = pool or workers.get_pool()
         self.__oid_handler = oid_handler
 
-        self.__running = True
         self.__pdu = 1
 
-        # default is 1
-        self.setDaemon(1)
-        self.start()
         self.__task_id = 0
+        self.__router = None
+
+    @property
+    def oid_handler(self):
+        return self.__oid_handler
+
+    @property
+    def router(self):
+        '''
+        Router of the columns of this PDU alone, built on first use as the
+        columns depend on the pdu number
+        '''
+        if self.__router is None:
+            self.__router = oidrouter.OIDRouter()
+            self.register_columns(self.__router)
+        return self.__router
 
     @property
     def pdu(self):
@@ -54,62 +67,84 @@ class vPDUBase(threading.Thread):
     def set_outlet_field(self, offset, outlet, val):
         oid = '.'.join([offset, str(outlet)])
         self.__oid_handler.update_oid_val(oid, val)
+        channel.notify("value", "{0} {1}".format(oid, val))
 
     def get_outlet_field(self, offset, outlet):
         oid = '.'.join([offset, str(outlet)])
         ret = self.__oid_handler.query_oid_val(oid)
         return ret
 
+    def get_outlets_field(self, offset):
+        '''
+        Return a dict outlet -> value of all outlets below offset, read with
+        one subtree query
+        '''
+        fields = {}
+        for oid, val in self.__oid_handler.query_subtree(offset):
+            outlet = oid[len(offset) + 1:]
+            if outlet.isdigit():
+                fields[int(outlet)] = val
+        return fields
+
+    def set_outlets_field(self, offset, outlets, val):
+        '''
+        Set the same value for a list of outlets at once
+        '''
+        oids = ['.'.join([offset, str(outlet)]) for outlet in outlets]
+        self.__oid_handler.update_many([(oid, val) for oid in oids])
+        for oid in oids:
+            channel.notify("value", "{0} {1}".format(oid, val))
+
     def set_outlet_mode(self, offset, outlet, mode):
         oid = '.'.join([offset, str(outlet)])
-        ret = self.__oid_handler.query_oid_val(oid)
-        if not ret:
-            return
+        self.__oid_handler.update_oid_mode(oid, mode)
+        channel.notify("mode", "{0} {1}".format(oid, mode))
 
-        try:
-            value_settings = {}
-            value_settings = \
-                dict([self.split(x, '=') for x in self.split(ret, ',')])
-            if 'mode' in value_settings and value_settings['mode'] == mode:
-                return
-
-            value_settings_str = \
-                'mode='+mode+',value=' + str(value_settings['value'])
-        except:
-            value_settings_str = 'mode='+mode+',value=' + str(ret)
-
-        self.__oid_handler.update_oid_val(oid, value_settings_str)
+    def set_outlets_mode(self, offset, outlets, mode):
+        '''
+        Put a list of outlets into mode at once
+        '''
+        oids = ['.'.join([offset, str(outlet)]) for outlet in outlets]
+        self.__oid_handler.update_mode_many([(oid, mode) for oid in oids])
+        for oid in oids:
+            channel.notify("mode", "{0} {1}".format(oid, mode))
 
     def get_outlet_mode(self, offset, outlet):
         oid = '.'.join([offset, str(outlet)])
-
-        ret = self.__oid_handler.query_oid_val(oid)
-        if not ret:
-            return ""
-
-        try:
-            value_settings = {}
-            value_settings = \
-                dict([self.split(x, '=') for x in self.split(ret, ',')])
-            if 'mode' in value_settings:
-                return value_settings['mode']
-
-            return ""
-        except:
-            logger.warn("Mode is not set!")
+        mode = self.__oid_handler.query_oid_mode(oid)
+        if mode is None:
             return ""
+        return mode
 
-    def add_task(self, task_name, func, *args):
+    def add_plan(self, plan_name, steps, outlet=None):
         '''
-        tasks: (fun, args)
+        Queue steps, a list of (func, args), as one task which runs them in
+        order, after the tasks queued for the same outlet. A plan of outlet
+        actions alone replaces such a plan of the outlet which did not
+        start yet, only the last action asked for is applied.
         '''
+        coalesce = None
+        if outlet is not None and \
+                all([func == self.handle_outlet for func, _ in steps]):
+            coalesce = "handle_outlet"
+        self.__submit(outlet, plan_name, self.run_plan, (steps,), coalesce)
+
+    def __submit(self, outlet, task_name, func, args, coalesce=None):
         task_name = "{task_name}-ID-{task_id}".\
             format(task_name=task_name, task_id=self.__task_id)
         self.__task_id += 1
         logger.info("Add task: {yellow}{task_name}{normal} for pdu {pdu}".
                     format(yellow=colors.YELLOW, task_name=task_name,
                            normal=colors.NORMAL, pdu=self.pdu))
-        self.__tasks_queue.put((task_name, func, args))
+        self.__pool.submit((self, outlet), task_name, func, args, coalesce)
+
+    def run_plan(self, args):
+        steps = args[0]
+        for func, step_args in steps:
+            try:
+                func(step_args)
+            except Exception, ex:
+                logger.error("{0}: {1}".format(func.__name__, ex))
 
     @abstractmethod
     def handle_outlet(self, args):
@@ -121,37 +156,14 @@ class vPDUBase(threading.Thread):
         return
 
     @abstractmethod
-    def handle_message(self, message):
+    def register_columns(self, router):
         '''
-        Handle message from snmp simulator.
-        Regarding how to handle the message, it depends on the type of message,
-        if some one runs a snmpset command, snmp simulator will receive this
-        command, then inform virtual PDU handler, the message format:
-        <OID> <value>.
-        The message is sent by snmp simulator with pipe (/tmp/inform)
+        Register the writable OID columns of the PDU and their handlers with
+        router, see oidrouter.py. The handlers are called with
+        (outlet, value) when snmpset wrote <column>.<outlet>.
         '''
         return
 
-    def run(self):
-        while self.__running:
-            try:
-                task_name, func, args = self.__tasks_queue.get()
-                logger.info("Running task ... {peachblow}{task_name}{normal} \
-                            on thread {threadname}".
-                            format(peachblow=colors.PEACHBLOW,
-                                   task_name=task_name,
-                                   normal=colors.NORMAL,
-                                   threadname=self.getName()))
-                func(args)
-                self.__tasks_queue.task_done()
-                logger.info("{cyan}{task_name}{normal} Done".
-                            format(cyan=colors.CYAN,
-                                   task_name=task_name,
-                                   normal=colors.NORMAL))
-            except Exception, ex:
-                logger.error("{0}: {1}".
-                             format(sys._getframe().f_code.co_name, ex))
-
     def main_loop(self):
         '''
         main entry for PDU. If you are emulating the PDU Gateway, then you can
@@ -0,0 +1,305 @@
+'''
+*********************************************************
+Copyright @ 2015 EMC Corporation All Rights Reserved
+*********************************************************
+
+Unix socket channel between the variation modules in snmpsimd and the vPDU,
+next to the inform pipe.
+
+Both sides send messages "<kind> <seq> <body>" framed as netstrings like on
+the inform pipe (see pipe.py), and acknowledge every message they receive
+with "ack <seq>". The variation modules send "inform" messages with the
+varbinds of a SET PDU, the vPDU sends notifications like "value <oid>
+<value>" or "mode <oid> <mode>" when it changed an OID, so caches in
+snmpsimd stay coherent without polling the database.
+
+The vPDU listens (Listener), the variation modules connect (Client) and
+fall back to the inform pipe while there is no connection. The vPDU
+acknowledges a message once it read it in full. The messages of a client
+which were not acknowledged when its connection broke are kept, the
+Informer (see pipe.py) sends their varbinds again, so an inform the vPDU
+died before reading is not lost but may arrive twice.
+'''
+import os
+import errno
+import socket
+import select
+import threading
+import pdusim.common.logger as logger
+import pdusim.common.pipe as pipe
+
+channel_socket = pipe.inform_pipe + ".sock"
+
+ACK = "ack"
+INFORM = pipe.INFORM
+
+# Seconds a send may block before the peer is given up
+SEND_TIMEOUT = 1.0
+
+# Seconds between connection attempts of a client
+RECONNECT_INTERVAL = 1.0
+
+
+class Connection(object):
+    '''
+    One end of a channel connection, not thread safe for sending
+    '''
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.sock.settimeout(SEND_TIMEOUT)
+        self.__buffer = ""
+        self.__seq = 0
+        # seq -> (kind, body) of the messages sent and not acknowledged
+        self.unacked = {}
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def send(self, kind, body):
+        '''
+        Send a message and return its sequence number, raise socket.error
+        if the connection is broken
+        '''
+        self.__seq += 1
+        self.unacked[self.__seq] = (kind, body)
+        self.sock.sendall(pipe.encode("{0} {1} {2}".
+                                      format(kind, self.__seq, body)))
+        return self.__seq
+
+    def receive(self):
+        '''
+        Read what is available and return (kind, body) of the complete
+        messages, acknowledging them. Acknowledgements are consumed. Raise
+        EOFError when the peer closed the connection.
+        '''
+        data = self.sock.recv(pipe.READ_SIZE)
+        if not data:
+            raise EOFError("connection closed")
+        self.__buffer += data
+        messages, self.__buffer = pipe.decode(self.__buffer)
+
+        received = []
+        for message in messages:
+            kind, seq, body = (message.split(" ", 2) + [""])[:3]
+            if kind == ACK:
+                self.unacked.pop(int(seq), None)
+                continue
+            self.sock.sendall(pipe.encode("{0} {1}".format(ACK, seq)))
+            received.append((kind, body))
+        return received
+
+    def close(self):
+        self.sock.close()
+
+
+class Listener(object):
+    '''
+    vPDU end of the channel, select() the descriptors of fds() and call
+    receive() when one of them is readable
+    '''
+
+    def __init__(self, path=channel_socket):
+        self.path = path
+        if os.path.exists(path):
+            os.unlink(path)
+        self.__sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.__sock.bind(path)
+        self.__sock.listen(5)
+        self.__sock.setblocking(0)
+        self.__connections = []
+        self.__lock = threading.Lock()
+
+    def fds(self):
+        with self.__lock:
+            return [self.__sock.fileno()] + \
+                [conn.fileno() for conn in self.__connections]
+
+    def receive(self):
+        '''
+        Accept new connections and return (kind, body) of the messages which
+        arrived on any connection
+        '''
+        self.__accept()
+        with self.__lock:
+            connections = list(self.__connections)
+        readable, _, _ = select.select(connections, [], [], 0)
+        received = []
+        for conn in readable:
+            try:
+                # Acknowledgements share the socket with notify()
+                with self.__lock:
+                    received.extend(conn.receive())
+            except (EOFError, ValueError, socket.error) as e:
+                logger.info("Channel connection closed: {0}".format(e))
+                self.__drop(conn)
+        return received
+
+    def __accept(self):
+        while True:
+            try:
+                sock, _ = self.__sock.accept()
+            except socket.error as e:
+                if e.errno in (errno.EAGAIN, errno.EINTR):
+                    return
+                raise
+            with self.__lock:
+                self.__connections.append(Connection(sock))
+            logger.info("Channel connection accepted.")
+
+    def __drop(self, conn):
+        with self.__lock:
+            if conn in self.__connections:
+                self.__connections.remove(conn)
+        conn.close()
+
+    def notify(self, kind, body):
+        '''
+        Send a notification to every connected variation module, it is
+        acknowledged asynchronously
+        '''
+        with self.__lock:
+            connections = list(self.__connections)
+        for conn in connections:
+            try:
+                with self.__lock:
+                    conn.send(kind, body)
+            except socket.error as e:
+                logger.warn("Failed to notify, dropping connection: {0}".
+                            format(e))
+                self.__drop(conn)
+
+    def close(self):
+        with self.__lock:
+            connections, self.__connections = self.__connections, []
+        for conn in connections:
+            conn.close()
+        self.__sock.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+_listener = None
+
+
+def set_listener(listener):
+    global _listener
+    _listener = listener
+
+
+def notify(kind, body):
+    '''
+    Notify the variation modules through the listener of this process, if
+    there is one
+    '''
+    if _listener is not None:
+        _listener.notify(kind, body)
+
+
+class Client(object):
+    '''
+    Variation module end of the channel. A thread keeps the connection up
+    and hands the notifications of the vPDU to handler(kind, body). snmpsimd
+    has its own logging, errors of handler are passed to log(message).
+    '''
+
+    def __init__(self, handler, log, path=channel_socket):
+        self.path = path
+        self.__handler = handler
+        self.__log = log
+        self.__conn = None
+        # (kind, body) of the messages lost with broken connections
+        self.__lost = []
+        self.__lock = threading.Lock()
+        self.__stop = threading.Event()
+        self.__thread = threading.Thread(target=self.__run,
+                                         name='channel-client')
+        self.__thread.setDaemon(True)
+        self.__thread.start()
+
+    @property
+    def connected(self):
+        return self.__conn is not None
+
+    def __connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+        except socket.error:
+            sock.close()
+            return False
+        with self.__lock:
+            self.__conn = Connection(sock)
+        return True
+
+    def __disconnect(self):
+        with self.__lock:
+            conn, self.__conn = self.__conn, None
+            if conn:
+                self.__lost.extend([conn.unacked[seq]
+                                    for seq in sorted(conn.unacked)])
+        if conn:
+            conn.close()
+
+    def __run(self):
+        while not self.__stop.is_set():
+            if self.__conn is None and not self.__connect():
+                self.__stop.wait(RECONNECT_INTERVAL)
+                continue
+
+            conn = self.__conn
+            try:
+                readable, _, _ = select.select([conn], [], [],
+                                               RECONNECT_INTERVAL)
+                if not readable:
+                    continue
+                with self.__lock:
+                    messages = conn.receive()
+            except (EOFError, ValueError, socket.error, select.error):
+                self.__disconnect()
+                continue
+
+            for kind, body in messages:
+                try:
+                    self.__handler(kind, body)
+                except Exception as e:
+                    self.__log("channel: {0} {1}: {2}".format(kind, body, e))
+
+    def send(self, kind, body):
+        '''
+        Send a message, return False if there is no connection to send it on
+        '''
+        with self.__lock:
+            conn = self.__conn
+            if conn is None:
+                return False
+            try:
+                conn.send(kind, body)
+                return True
+            except socket.error:
+                pass
+        self.__disconnect()
+        return False
+
+    def unacked(self):
+        '''
+        Return the number of messages the vPDU did not acknowledge yet,
+        including the lost ones
+        '''
+        with self.__lock:
+            pending = len(self.__conn.unacked) if self.__conn else 0
+            return pending + len(self.__lost)
+
+    def lost(self):
+        '''
+        Return (kind, body) of the messages sent on connections which broke
+        before the vPDU acknowledged them, oldest first, and forget them
+        '''
+        with self.__lock:
+            lost, self.__lost = self.__lost, []
+        return lost
+
+    def close(self):
+        self.__stop.set()
+        self.__thread.join()
+        self.__disconnect()
@@ -19,6 +19,8 @@ class Config(object):
                                         "conf/vm_pdu_mappings.conf")
         self.host_conf = os.path.join(install_data_dir, "conf/host.conf")
         self.password_file = os.path.join(install_data_dir, "conf/password")
+        self.telemetry_profile = os.path.join(install_data_dir,
+                                              "conf/telemetry.conf")
         self.variation_modules_dir = os.path.join(install_data_dir, "variation")
         self.__config_parser = ConfigParser.ConfigParser()
         self.__pdu_name = ""
@@ -27,6 +29,8 @@ class Config(object):
         self.__db_file = ""
         self.__sim_file = ""
         self.__snmp_data_dir = ""
+        self.__workers = 8
+        self.__tenants = {}
         self.init()
 
     @property
@@ -76,8 +80,37 @@ class Config(object):
     def snmp_data_dir(self, value):
         self.__snmp_data_dir = value
 
+    @property
+    def workers(self):
+        '''
+        Size of the worker pool running the outlet actions of all PDUs
+        '''
+        return self.__workers
+
+    @property
+    def tenants(self):
+        '''
+        community -> (database, table) of the [tenants] section
+        '''
+        return self.__tenants
+
+    def __read_tenants(self):
+        # Communities are case sensitive, so keep the option names as they are
+        parser = ConfigParser.RawConfigParser()
+        parser.optionxform = str
+        parser.read(self.host_conf)
+        self.__tenants = {}
+        for s in parser.sections():
+            if s.upper() != "TENANTS":
+                continue
+            for community, value in parser.items(s):
+                database, _, table = value.partition(":")
+                self.__tenants[community] = \
+                    (database.strip(), table.strip() or self.default_table_name)
+
     def init(self):
         self.__config_parser.read(self.host_conf)
+        self.__read_tenants()
 
         try:
             for s in self.__config_parser.sections():
@@ -104,6 +137,10 @@ class Config(object):
 
                     if self.__config_parser.has_option(s, "simfile"):
                         self.__sim_file = self.__config_parser.get(s, "simfile")
+
+                    if self.__config_parser.has_option(s, "workers"):
+                        self.__workers = \
+                            self.__config_parser.getint(s, "workers")
         except ConfigParser.NoSectionError:
             logger.error("No section %s" % s)
         except ConfigParser.NoOptionError:
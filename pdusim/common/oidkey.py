@@ -0,0 +1,83 @@
+'''
+*********************************************************
+Copyright @ 2015 EMC Corporation All Rights Reserved
+*********************************************************
+
+Compact, byte-sortable encoding of OIDs.
+
+Every sub-identifier is stored as a length byte followed by the minimal
+big-endian bytes of its value, so comparing two keys with memcmp gives the
+same order as comparing the OIDs numerically, and every OID sorts right
+before its subtree. 1.3.6.1.4.1.3711 takes 16 bytes instead of the 76
+characters of the legacy space-padded text form.
+'''
+
+
+def _components(oid):
+    if isinstance(oid, tuple):
+        return oid
+    oid = str(oid)
+    if not oid:
+        return ()
+    return [int(x) for x in oid.split('.')]
+
+
+def _encode_component(n):
+    body = bytearray()
+    while n:
+        body.insert(0, n & 0xff)
+        n >>= 8
+    return bytes(bytearray([len(body)]) + body)
+
+
+# Most sub-identifiers are below 256, their encoding is looked up
+_SMALL = [_encode_component(n) for n in range(0x100)]
+
+
+def encode(oid):
+    '''
+    Encode an OID given as a dotted string, tuple or pysnmp ObjectName
+    '''
+    return b''.join([_SMALL[n] if 0 <= n < 0x100 else _encode_component(n)
+                     for n in [int(x) for x in _components(oid)]])
+
+
+def decode(key):
+    '''
+    Return the dotted OID of an encoded key
+    '''
+    key = bytearray(key)
+    components = []
+    pos = 0
+    end = len(key)
+    while pos < end:
+        length = key[pos]
+        if length == 1:
+            components.append(str(key[pos + 1]))
+        else:
+            n = 0
+            for b in key[pos + 1:pos + 1 + length]:
+                n = (n << 8) | b
+            components.append(str(n))
+        pos += 1 + length
+    return '.'.join(components)
+
+
+def subtree_end(key):
+    '''
+    Return the smallest key greater than every key in the subtree of key.
+    '''
+    # The byte following an OID in any key below it is a length byte, which
+    # never reaches 0xff.
+    return key + b'\xff'
+
+
+def to_sql_oid(oid):
+    '''
+    Legacy text form, every sub-identifier right aligned in 10 characters
+    '''
+    return '.'.join(['%10s' % x for x in str(oid).split('.')])
+
+
+def from_sql_oid(sql_oid):
+    return '.'.join([x.strip() for x in str(sql_oid).split('.')])
@@ -2,20 +2,97 @@
 *********************************************************
 Copyright @ 2015 EMC Corporation All Rights Reserved
 *********************************************************
+
+The inform pipe carries the varbinds written by snmpset from the variation
+modules in snmpsimd to the vPDU. A message holds the varbinds of one SET
+PDU as "<oid> <value>" lines. Messages are framed as netstrings,
+"<length>:<message>," with the decimal byte length of the message, so
+several of them may arrive in one read or one may be split across reads.
 '''
 import os
+import errno
+import select
 import tempfile
+import threading
+import collections
+import pdusim.common.logger as logger
+
+inform_pipe = os.path.join(tempfile.gettempdir(), "inform")
+
+# Kind of the channel messages carrying informs, see channel.py
+INFORM = "inform"
+
+# Bytes read from the pipe at once
+READ_SIZE = 65536
+
+# Longer lengths are garbage
+MAX_LENGTH_DIGITS = 9
+
+# OIDs an Informer keeps for the vPDU while it does not read
+MAX_QUEUED = 1000
+
+# Seconds between attempts of an Informer to deliver what it keeps
+RETRY_INTERVAL = 1.0
+
+
+def join_varbinds(varbinds):
+    return "\n".join(["{0} {1}".format(oid, value) for oid, value in varbinds])
+
+
+def varbinds(message):
+    '''
+    Return the (oid, value) of the varbinds of a message
+    '''
+    return [tuple(line.split(" ", 1)) for line in message.split("\n")
+            if line]
+
+
+def encode(message):
+    return "{0}:{1},".format(len(message), message)
+
+
+def decode(data):
+    '''
+    Return the complete messages at the start of data and the rest of data,
+    which is the beginning of the next message
+    '''
+    messages = []
+    pos = 0
+    while True:
+        colon = data.find(":", pos, pos + MAX_LENGTH_DIGITS + 1)
+        if colon < 0:
+            rest = data[pos:]
+            if len(rest) > MAX_LENGTH_DIGITS or rest and not rest.isdigit():
+                raise ValueError("bad message length {0!r}".format(rest))
+            break
+        length = data[pos:colon]
+        if not length.isdigit():
+            raise ValueError("bad message length {0!r}".format(length))
+        end = colon + 1 + int(length)
+        if end >= len(data):
+            break
+        if data[end] != ",":
+            raise ValueError("message not terminated at {0}".format(end))
+        messages.append(data[colon + 1:end])
+        pos = end + 1
+    return messages, data[pos:]
 
 
 class Pipe(object):
+    '''
+    Reading end of the inform pipe. With a channel listener (see
+    channel.py) the informs arriving on the channel are read as well.
+    '''
 
-    inform_pipe = os.path.join(tempfile.gettempdir(), "inform")
+    inform_pipe = inform_pipe
 
-    def __init__(self):
+    def __init__(self, listener=None):
         if not os.path.exists(self.inform_pipe):
             os.mkfifo(self.inform_pipe)
 
         self.__inform = os.open(self.inform_pipe, os.O_RDONLY | os.O_NONBLOCK)
+        self.__buffer = ""
+        self.__listener = listener
 
     def __enter__(self):
         return self
@@ -36,8 +113,235 @@ class Pipe(object):
             self.__inform = os.open(self.inform_pipe,
                                     os.O_RDONLY | os.O_NONBLOCK)
 
+    def fds(self):
+        '''
+        Descriptors to select() for reading before read_messages()
+        '''
+        if self.__listener is None:
+            return [self.__inform]
+        return [self.__inform] + self.__listener.fds()
+
     def read(self, nbytes=-1):
         return os.read(self.__inform, nbytes)
 
+    def read_messages(self):
+        '''
+        Read everything there is in the pipe and return the complete
+        messages, a message which is not complete yet is kept for the next
+        call
+        '''
+        while True:
+            try:
+                data = os.read(self.__inform, READ_SIZE)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EINTR):
+                    break
+                raise
+            if not data:
+                break
+            self.__buffer += data
+
+        try:
+            messages, self.__buffer = decode(self.__buffer)
+        except ValueError as e:
+            # Nothing after garbage can be trusted
+            logger.error("Dropped {0} bytes of the inform pipe: {1}".
+                         format(len(self.__buffer), e))
+            messages, self.__buffer = [], ""
+
+        if self.__listener is not None:
+            messages.extend([body for kind, body in self.__listener.receive()
+                             if kind == INFORM])
+        return messages
+
     def close(self):
         os.close(self.__inform)
+        if self.__listener is not None:
+            self.__listener.close()
+
+
+class Informer(object):
+    '''
+    Writing end of the inform pipe, used by the variation modules. Messages
+    go over the channel client instead while it is connected.
+
+    Varbinds which can not be delivered, because the vPDU is slow or
+    restarting, wait in a queue of at most max_queued OIDs and a thread
+    retries them every retry_interval seconds, so a SET never waits for the
+    vPDU. A queued OID written again keeps only the newer value, the oldest
+    OIDs are dropped when the queue is full. The varbinds of the channel
+    messages the vPDU did not acknowledge before the connection broke are
+    queued again unless their OID was written since.
+    '''
+
+    def __init__(self, path=inform_pipe, channel=None,
+                 max_queued=MAX_QUEUED, retry_interval=RETRY_INTERVAL):
+        if not os.path.exists(path):
+            os.mkfifo(path)
+        self.path = path
+        self.max_queued = max_queued
+        self.retry_interval = retry_interval
+        self.__fd = None
+        self.__channel = channel
+        self.__varbinds = []
+        # oid -> value, oldest first
+        self.__queue = collections.OrderedDict()
+        self.__lock = threading.Lock()
+        self.__retrier = None
+        self.__stop = threading.Event()
+        self.sent = 0
+        self.retries = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.resent = 0
+        if channel is not None:
+            # Picks up what a broken connection lost
+            self.__start_retrier()
+
+    def add(self, oid, value, first=False, last=True):
+        '''
+        Add a varbind of a SET PDU, the varbinds of the PDU are sent as one
+        message after the last of them. Varbinds left over from a PDU which
+        failed before its last varbind are sent when the next PDU begins.
+        Callers which commit the SETs later add with last=False and call
+        flush() after the commit.
+        '''
+        if first:
+            self.flush()
+        self.__varbinds.append((str(oid), value))
+        if last:
+            self.flush()
+
+    def flush(self):
+        '''
+        Queue the varbinds added so far and send what is queued, return
+        False if some of it is left for the retry thread
+        '''
+        varbinds, self.__varbinds = self.__varbinds, []
+        with self.__lock:
+            for oid, value in varbinds:
+                if oid in self.__queue:
+                    # Superseded, the vPDU only needs the last value
+                    del self.__queue[oid]
+                    self.coalesced += 1
+                self.__queue[oid] = value
+            self.__trim()
+            return self.__deliver()
+
+    def __trim(self):
+        while len(self.__queue) > self.max_queued:
+            self.__queue.popitem(last=False)
+            self.dropped += 1
+
+    def __requeue_lost(self):
+        '''
+        Queue the varbinds of the informs lost with a broken channel
+        connection in front of the queue, the queued value of an OID is
+        newer. Called with the lock held.
+        '''
+        lost = collections.OrderedDict()
+        for kind, body in self.__channel.lost():
+            if kind != INFORM:
+                continue
+            for oid, value in varbinds(body):
+                lost.pop(oid, None)
+                lost[oid] = value
+                self.resent += 1
+        if not lost:
+            return
+        for oid, value in self.__queue.iteritems():
+            lost.pop(oid, None)
+            lost[oid] = value
+        self.__queue = lost
+        self.__trim()
+
+    def __deliver(self):
+        '''
+        Send the queue, as several messages if it does not fit into one
+        atomic write to the pipe. Called with the lock held.
+        '''
+        if self.__channel is not None:
+            self.__requeue_lost()
+        while self.__queue:
+            batch = []
+            size = 0
+            for varbind in self.__queue.iteritems():
+                # The line, its separator and the frame
+                length = len(varbind[0]) + len(varbind[1]) + 2
+                if batch and size + length + 12 > select.PIPE_BUF:
+                    break
+                batch.append(varbind)
+                size += length
+            try:
+                self.send(join_varbinds(batch))
+            except (OSError, IOError):
+                # Reopened on the next attempt, the vPDU may have restarted
+                self.__close_fd()
+                self.__start_retrier()
+                return False
+            for oid, _ in batch:
+                del self.__queue[oid]
+            self.sent += 1
+        return True
+
+    def send(self, message):
+        '''
+        Write one message, raise OSError if the vPDU does not read the pipe
+        and IOError if the message was not written at once
+        '''
+        if self.__channel is not None and \
+                self.__channel.send(INFORM, message):
+            return
+        if self.__fd is None:
+            # Fails with ENXIO while nobody reads the pipe
+            self.__fd = os.open(self.path, os.O_WRONLY | os.O_NONBLOCK)
+        data = encode(message)
+        written = os.write(self.__fd, data)
+        if written != len(data):
+            raise IOError("Expected length {0}, actual length {1}".
+                          format(len(data), written))
+
+    def __close_fd(self):
+        if self.__fd is not None:
+            os.close(self.__fd)
+            self.__fd = None
+
+    def __start_retrier(self):
+        if self.__retrier is None:
+            self.__retrier = threading.Thread(target=self.__retry,
+                                              name='inform-retry')
+            self.__retrier.setDaemon(True)
+            self.__retrier.start()
+
+    def __retry(self):
+        while not self.__stop.wait(self.retry_interval):
+            with self.__lock:
+                if self.__queue:
+                    self.retries += 1
+                self.__deliver()
+
+    def counters(self):
+        '''
+        Return the queue depth and the delivery counters as a dict
+        '''
+        with self.__lock:
+            return {"queued": len(self.__queue),
+                    "unacked": self.__channel.unacked()
+                    if self.__channel is not None else 0,
+                    "sent": self.sent,
+                    "retries": self.retries,
+                    "coalesced": self.coalesced,
+                    "dropped": self.dropped,
+                    "resent": self.resent}
+
+    def close(self):
+        '''
+        Stop retrying and make a last attempt to send the queue, return
+        False if it was not delivered
+        '''
+        self.__stop.set()
+        if self.__retrier is not None:
+            self.__retrier.join()
+        delivered = self.flush()
+        self.__close_fd()
+        return delivered
@@ -0,0 +1,201 @@
+'''
+*********************************************************
+Copyright @ 2015 EMC Corporation All Rights Reserved
+*********************************************************
+
+snmprec table of a SQLite database held in memory.
+
+Rows are read into a dict keyed by the encoded OID (see common/oidkey.py)
+with a sorted key list for GETNEXT. Writes only change memory, snapshot()
+writes the changed rows back to the database. refresh() picks up what other
+processes commit to the database, like the vPDU changing the mode of an
+outlet. A row changed in memory since the last snapshot keeps its value,
+unless another process wrote the row meanwhile.
+
+Upgraded tables tell such writes by the version of the row (see
+snmprecdb.py), even a write of the value the row had before. snapshot()
+only updates rows whose version did not change since they were read, the
+database wins for the others. Legacy tables compare the values, a write of
+the old value goes unnoticed there.
+'''
+import sqlite3
+import bisect
+import threading
+import common.oidkey as oidkey
+import snmprecdb
+
+# Fields of a row
+TAG = 0
+VALUE = 1
+MAXACCESS = 2
+MODE = 3
+
+
+class MemoryTable(object):
+    '''
+    The connection is owned by the caller, it is used from the threads
+    calling snapshot() as well.
+    '''
+
+    def __init__(self, conn, table="snmprec"):
+        self.table = table
+        self.__conn = conn
+        self.__lock = threading.RLock()
+        self.__has_oid_key = snmprecdb.has_oid_key(conn, table)
+        self.__has_mode = snmprecdb.has_mode(conn, table)
+        self.__has_version = snmprecdb.has_version(conn, table)
+        self.__rows = {}
+        self.__keys = []
+        # Version, or (tag, value) of legacy tables, of the rows as last
+        # read from or written to the database
+        self.__stored = {}
+        self.__dirty = set()
+        self.__version = None
+        self.snapshots = 0
+        self.load()
+
+    def __data_version(self):
+        return self.__conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def load(self):
+        '''
+        Read all rows, keeping the rows changed in memory since the last
+        snapshot which no other process wrote meanwhile
+        '''
+        mode = snmprecdb.MODE_COLUMN if self.__has_mode else "NULL"
+        version = snmprecdb.VERSION_COLUMN if self.__has_version else "NULL"
+        with self.__lock:
+            self.__version = self.__data_version()
+            rows = {}
+            stored = {}
+            for oid, tag, value, maxaccess, row_mode, row_version in \
+                    self.__conn.execute(
+                        "select oid, tag, value, maxaccess, %s, %s from %s" %
+                        (mode, version, self.table)):
+                if not self.__has_mode:
+                    row_mode, value = snmprecdb.split_mode(value)
+                key = oidkey.encode(oidkey.from_sql_oid(oid))
+                rows[key] = [str(tag), str(value), maxaccess, row_mode]
+                if self.__has_version:
+                    stored[key] = row_version
+                else:
+                    stored[key] = (str(tag), str(value))
+
+            for key in list(self.__dirty):
+                if key in rows and stored[key] == self.__stored.get(key):
+                    rows[key][TAG] = self.__rows[key][TAG]
+                    rows[key][VALUE] = self.__rows[key][VALUE]
+                else:
+                    # Written by another process, which wins
+                    self.__dirty.discard(key)
+
+            if len(rows) != len(self.__rows) or \
+                    any([key not in self.__rows for key in rows]):
+                self.__keys = sorted(rows)
+            self.__rows = rows
+            self.__stored = stored
+
+    def refresh(self):
+        '''
+        Reload the rows if another connection committed to the database
+        '''
+        with self.__lock:
+            if self.__data_version() != self.__version:
+                self.load()
+
+    def get(self, oid):
+        '''
+        Return [tag, value, maxaccess, mode] of oid, None if it is not in the
+        table
+        '''
+        with self.__lock:
+            return self.__rows.get(oidkey.encode(oid))
+
+    def get_next(self, oid):
+        '''
+        Return (oid, [tag, value, maxaccess, mode]) of the first OID after
+        oid, None at the end of the table
+        '''
+        with self.__lock:
+            i = bisect.bisect_right(self.__keys, oidkey.encode(oid))
+            if i == len(self.__keys):
+                return None
+            key = self.__keys[i]
+            return oidkey.decode(key), self.__rows[key]
+
+    def subtree(self, prefix):
+        '''
+        Return (oid, [tag, value, maxaccess, mode]) of the OIDs below prefix
+        in OID order
+        '''
+        key = oidkey.encode(prefix)
+        with self.__lock:
+            start = bisect.bisect_right(self.__keys, key)
+            end = bisect.bisect_left(self.__keys, oidkey.subtree_end(key))
+            return [(oidkey.decode(k), self.__rows[k])
+                    for k in self.__keys[start:end]]
+
+    def set(self, oid, tag, value):
+        '''
+        Change tag and value of oid in memory, return False if oid is not in
+        the table
+        '''
+        key = oidkey.encode(oid)
+        with self.__lock:
+            row = self.__rows.get(key)
+            if row is None:
+                return False
+            row[TAG] = tag
+            row[VALUE] = value
+            self.__dirty.add(key)
+            return True
+
+    def snapshot(self):
+        '''
+        Write the rows changed since the last snapshot to the database in one
+        transaction, return their number
+        '''
+        with self.__lock:
+            # Do not overwrite what other processes wrote since the last load
+            self.refresh()
+            if not self.__dirty:
+                return 0
+
+            if self.__has_oid_key:
+                where = snmprecdb.OID_KEY_COLUMN
+                params = [(key, sqlite3.Binary(key)) for key in self.__dirty]
+            else:
+                where = "oid"
+                params = [(key, oidkey.to_sql_oid(oidkey.decode(key)))
+                          for key in self.__dirty]
+
+            statement = "update %s set tag=?, value=? where %s=?" % \
+                (self.table, where)
+            if self.__has_version:
+                # Another process may have written the row since refresh()
+                statement += " and %s=?" % snmprecdb.VERSION_COLUMN
+            updated = 0
+            for key, param in params:
+                row = self.__rows[key]
+                value = row[VALUE]
+                if not self.__has_mode:
+                    # The mode is folded into the value
+                    value = snmprecdb.join_mode(row[MODE], value)
+                if self.__has_version:
+                    changed = self.__conn.execute(
+                        statement, (row[TAG], value, param,
+                                    self.__stored[key])).rowcount
+                    # Incremented by the trigger
+                    self.__stored[key] += changed
+                else:
+                    changed = self.__conn.execute(
+                        statement, (row[TAG], value, param)).rowcount
+                    self.__stored[key] = (row[TAG], row[VALUE])
+                updated += changed
+            self.__conn.commit()
+            self.__dirty.clear()
+            if updated < len(params):
+                # Take what the other process wrote
+                self.load()
+            self.snapshots += 1
+            return updated
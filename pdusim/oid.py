@@ -7,10 +7,28 @@ import sys
 import os
 import sqlite3
 import shelve
+import threading
+import collections
 from pysnmp.proto import rfc1902
 from abc import ABCMeta, abstractmethod
 import common.config as config
 import common.logger as logger
+import common.oidkey as oidkey
+import snmprecdb
+import snmprecfile
+import oidmmap
+
+
+def _pairs(oid_vals):
+    if isinstance(oid_vals, dict):
+        return oid_vals.items()
+    return list(oid_vals)
+
+
+def _text(val):
+    if isinstance(val, basestring):
+        return val
+    return str(val)
 
 
 class OIDBase(object):
@@ -42,94 +60,360 @@ class OIDBase(object):
     def update_oid_tag(self, oid, tag):
         return
 
+    def query_many(self, oids):
+        '''
+        Query values for a list of oids, return a dict oid -> value
+        '''
+        return dict([(str(oid), self.query_oid_val(oid)) for oid in oids])
+
+    def update_many(self, oid_vals):
+        '''
+        Update values, oid_vals is a dict oid -> value or a list of pairs
+        '''
+        for oid, val in _pairs(oid_vals):
+            self.update_oid_val(oid, val)
+
+    def query_tag_many(self, oids):
+        '''
+        Query tags for a list of oids, return a dict oid -> tag
+        '''
+        return dict([(str(oid), self.query_oid_tag(oid)) for oid in oids])
+
+    def update_tag_many(self, oid_tags):
+        '''
+        Update tags, oid_tags is a dict oid -> tag or a list of pairs
+        '''
+        for oid, tag in _pairs(oid_tags):
+            self.update_oid_tag(oid, tag)
+
+    def query_mode_many(self, oids):
+        '''
+        Query the mode of outlet oids, return a dict oid -> mode, None for
+        oids without mode.
+        '''
+        values = self.query_many(oids)
+        return dict([(oid, snmprecdb.split_mode(val)[0] if val else None)
+                     for oid, val in values.items()])
+
+    def query_oid_mode(self, oid):
+        return self.query_mode_many([oid])[str(oid)]
+
+    def update_mode_many(self, oid_modes):
+        '''
+        Put outlet oids into a mode, oid_modes is a dict oid -> mode or a
+        list of pairs. Handlers without a mode column keep it in the value
+        as 'mode=<mode>,value=<value>'.
+        '''
+        oid_modes = _pairs(oid_modes)
+        values = self.query_many([oid for oid, _ in oid_modes])
+        updates = []
+        for oid, mode in oid_modes:
+            val = values.get(str(oid))
+            if not val:
+                continue
+            current, plain = snmprecdb.split_mode(val)
+            if current != mode:
+                updates.append((oid, snmprecdb.join_mode(mode, plain)))
+        if updates:
+            self.update_many(updates)
+
+    def update_oid_mode(self, oid, mode):
+        self.update_mode_many([(oid, mode)])
+
+    @abstractmethod
+    def query_subtree(self, prefix):
+        '''
+        Iterate (oid, value) of the oids below prefix in OID order
+        '''
+        return
+
+    def query_oids_by_mode(self, mode, prefix=None):
+        '''
+        Return the oids in mode, below prefix if given
+        '''
+        if prefix is None:
+            # Every OID is below iso(1)
+            prefix = "1"
+        return [oid for oid, val in self.query_subtree(prefix)
+                if snmprecdb.split_mode(val)[0] == mode]
+
+    def invalidate(self, oid):
+        '''
+        Drop anything remembered about oid, called when the value was changed
+        outside of this handler, e.g. by snmpset.
+        '''
+        return
+
+    def close(self):
+        '''
+        Release resources held by the handler
+        '''
+        return
+
 
 class SqliteOIDHandler(OIDBase):
-    def __init__(self):
+    # Seconds a connection waits on a lock held by snmpsimd before failing
+    busy_timeout = 10
+
+    # Number of compiled statements kept per connection
+    cached_statements = 32
+
+    # OIDs bound in one statement, SQLite allows 999 parameters at most
+    max_batch = 500
+
+    def __init__(self, db_file=None, table_name=None):
         '''
         Constructor
+
+        db_file and table_name default to the configured database, they are
+        only given explicitly by tools working on a database directly.
         '''
         super(SqliteOIDHandler, self).__init__()
         self.config_instance = config.get_conf_instance()
-        self.__db_file = os.path.join(self.config_instance.snmp_data_dir,
-                                      self.config_instance.db_file)
+        if db_file is None:
+            db_file = os.path.join(self.config_instance.snmp_data_dir,
+                                   self.config_instance.db_file)
+        if table_name is None:
+            table_name = self.config_instance.default_table_name
+        self.__db_file = db_file
+
+        # One long-lived connection per thread, sqlite3 connections must not
+        # be shared between threads, but each PDU runs its tasks on its own
+        # thread and would otherwise reconnect for every single access.
+        self.__local = threading.local()
+        self.__connections = []
+        self.__lock = threading.Lock()
+
+        self.__table_name = table_name
+        self.__statements = None
+        self.__to_key = None
+        self.__from_key = None
+        self.__has_mode = False
+
+    def __connection(self):
+        conn = getattr(self.__local, 'conn', None)
+        if conn is not None:
+            return conn
 
-    def update_oid_val(self, oid, val):
-        '''
-        Update value for oid
-        '''
         if not os.path.exists(self.__db_file):
             logger.error("Database %s does not exist!" % self.__db_file)
             sys.exit(1)
 
-        # open db
-        conn = sqlite3.connect(self.__db_file)
-        cur = conn.cursor()
-        sql_oid = '.'.join(['%10s' % x for x in str(oid).split('.')])
-        update_statement = 'update %s set value = \'%s\' where oid=\'%s\'' % \
-            (self.config_instance.default_table_name, val, sql_oid)
-        cur.execute(update_statement)
-        conn.commit()
-        conn.close()
+        conn = sqlite3.connect(self.__db_file,
+                               timeout=self.busy_timeout,
+                               check_same_thread=False,
+                               cached_statements=self.cached_statements)
+        # WAL lets snmpsimd keep reading while the vPDU writes, the journal
+        # mode is persistent in the database file. With WAL, NORMAL
+        # synchronous is still safe against corruption and saves an fsync
+        # per commit.
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
 
-    def query_oid_val(self, oid):
+        with self.__lock:
+            # Release connections of threads which have gone, e.g. password
+            # timers.
+            alive = []
+            for thread, c in self.__connections:
+                if thread.is_alive():
+                    alive.append((thread, c))
+                else:
+                    c.close()
+            alive.append((threading.current_thread(), conn))
+            self.__connections = alive
+
+            if self.__statements is None:
+                self.__prepare_statements(conn)
+
+        self.__local.conn = conn
+        return conn
+
+    def __prepare_statements(self, conn):
         '''
-        Query value for oid
+        Look up rows by the encoded OID key if the database was upgraded,
+        by the legacy padded text otherwise.
         '''
-        if not os.path.exists(self.__db_file):
-            logger.error("Database %s does not exist!" % self.__db_file)
-            sys.exit(1)
-        # open db
-        conn = sqlite3.connect(self.__db_file)
-        cur = conn.cursor()
-        sql_oid = '.'.join(['%10s' % x for x in str(oid).split('.')])
-        query_statement = 'select value from %s where oid=\'%s\'' % \
-            (self.config_instance.default_table_name, sql_oid)
-        cur.execute(query_statement)
+        if snmprecdb.has_oid_key(conn, self.__table_name):
+            column = snmprecdb.OID_KEY_COLUMN
+            self.__to_key = snmprecdb.key_param
+            self.__from_key = lambda key: oidkey.decode(bytes(key))
+        else:
+            column = "oid"
+            self.__to_key = oidkey.to_sql_oid
+            self.__from_key = oidkey.from_sql_oid
+        self.__has_mode = snmprecdb.has_mode(conn, self.__table_name)
+
+        # Table names can not be bound as parameters, so build the statements
+        # once and let sqlite3 cache the compiled form per connection.
+        params = {"table": self.__table_name, "column": column}
+        statements = {
+            "query_val": 'select value from %(table)s where %(column)s=?',
+            "update_val": 'update %(table)s set value=? where %(column)s=?',
+            "query_tag": 'select tag from %(table)s where %(column)s=?',
+            "update_tag": 'update %(table)s set tag=? where %(column)s=?',
+            "query_val_many":
+                'select %(column)s, value from %(table)s '
+                'where %(column)s in (%%s)',
+            "query_tag_many":
+                'select %(column)s, tag from %(table)s '
+                'where %(column)s in (%%s)',
+            "query_mode_many":
+                'select %(column)s, mode from %(table)s '
+                'where %(column)s in (%%s)',
+            "update_mode": 'update %(table)s set mode=? where %(column)s=?',
+            "query_by_mode":
+                'select %(column)s from %(table)s where mode=?',
+            "query_by_mode_in_range":
+                'select %(column)s from %(table)s where mode=? '
+                'and %(column)s>? and %(column)s<?',
+            "query_subtree":
+                'select %(column)s, value from %(table)s '
+                'where %(column)s>? and %(column)s<? order by %(column)s'
+        }
+        for name in statements:
+            statements[name] = statements[name] % params
+        self.__statements = statements
+
+    def __query(self, statement, oid):
+        conn = self.__connection()
+        cur = conn.execute(self.__statements[statement], (self.__to_key(oid),))
         resultset = cur.fetchone()
-        conn.close()
+        cur.close()
         if resultset:
             return resultset[0]
 
+    def __update(self, statement, oid, val):
+        conn = self.__connection()
+        conn.execute(self.__statements[statement],
+                     (_text(val), self.__to_key(oid)))
+        conn.commit()
+
+    def __query_many(self, statement, oids):
+        conn = self.__connection()
+        oids = [str(oid) for oid in oids]
+        result = dict([(oid, None) for oid in oids])
+
+        params = [self.__to_key(oid) for oid in oids]
+        # Map the key column of the result rows back to the OIDs
+        keys = dict([(bytes(param), oid) for param, oid in zip(params, oids)])
+        for start in range(0, len(params), self.max_batch):
+            chunk = params[start:start + self.max_batch]
+            query_statement = self.__statements[statement] % \
+                ','.join(['?'] * len(chunk))
+            for key, val in conn.execute(query_statement, chunk):
+                result[keys[bytes(key)]] = val
+        return result
+
+    def __update_many(self, statement, oid_vals):
+        conn = self.__connection()
+        # All rows are written in a single transaction
+        conn.executemany(self.__statements[statement],
+                         [(_text(val), self.__to_key(oid))
+                          for oid, val in _pairs(oid_vals)])
+        conn.commit()
+
+    def update_oid_val(self, oid, val):
+        '''
+        Update value for oid
+        '''
+        self.__update("update_val", oid, val)
+
+    def query_oid_val(self, oid):
+        '''
+        Query value for oid
+        '''
+        return self.__query("query_val", oid)
+
     def query_oid_tag(self, oid):
         '''
         Query tag for oid
         '''
-
-        if not os.path.exists(self.__db_file):
-            logger.error("Database %s does not exist!" % self.__db_file)
-            sys.exit(1)
-        # open db
-        conn = sqlite3.connect(self.__db_file)
-        cur = conn.cursor()
-        sql_oid = '.'.join(['%10s' % x for x in str(oid).split('.')])
-        query_statement = 'select tag from %s where oid=\'%s\'' % \
-            (self.config_instance.default_table_name, sql_oid)
-        cur.execute(query_statement)
-        resultset = cur.fetchone()
-        conn.close()
-        if resultset:
-            return resultset[0]
+        return self.__query("query_tag", oid)
 
     def update_oid_tag(self, oid, tag):
         '''
-        Update value for oid
+        Update tag for oid
         '''
-        if not os.path.exists(self.__db_file):
-            logger.error("Database %s does not exist!" % self.__db_file)
-            sys.exit(1)
+        self.__update("update_tag", oid, tag)
 
-        # open db
-        conn = sqlite3.connect(self.__db_file)
-        cur = conn.cursor()
-        sql_oid = '.'.join(['%10s' % x for x in str(oid).split('.')])
-        update_statement = 'update %s set tag = \'%s\' where oid=\'%s\'' % \
-            (self.config_instance.default_table_name, tag, sql_oid)
-        cur.execute(update_statement)
-        conn.commit()
-        conn.close()
+    def query_many(self, oids):
+        return self.__query_many("query_val_many", oids)
+
+    def update_many(self, oid_vals):
+        self.__update_many("update_val", oid_vals)
+
+    def query_tag_many(self, oids):
+        return self.__query_many("query_tag_many", oids)
+
+    def update_tag_many(self, oid_tags):
+        self.__update_many("update_tag", oid_tags)
+
+    def query_mode_many(self, oids):
+        self.__connection()
+        if not self.__has_mode:
+            return super(SqliteOIDHandler, self).query_mode_many(oids)
+        return self.__query_many("query_mode_many", oids)
+
+    def update_mode_many(self, oid_modes):
+        self.__connection()
+        if not self.__has_mode:
+            return super(SqliteOIDHandler, self).update_mode_many(oid_modes)
+        self.__update_many("update_mode", oid_modes)
+
+    def query_oids_by_mode(self, mode, prefix=None):
+        '''
+        Return the oids in mode with one query on the mode index
+        '''
+        conn = self.__connection()
+        if not self.__has_mode:
+            return super(SqliteOIDHandler, self).query_oids_by_mode(mode,
+                                                                    prefix)
+        if prefix is None:
+            rows = conn.execute(self.__statements["query_by_mode"], (mode,))
+        else:
+            rows = conn.execute(self.__statements["query_by_mode_in_range"],
+                                (mode,) + self.__subtree_range(prefix))
+        return [self.__from_key(row[0]) for row in rows]
+
+    def query_subtree(self, prefix):
+        '''
+        Iterate (oid, value) below prefix with a range scan on the key index
+        '''
+        conn = self.__connection()
+        cur = conn.execute(self.__statements["query_subtree"],
+                           self.__subtree_range(prefix))
+        try:
+            for key, val in cur:
+                yield self.__from_key(key), val
+        finally:
+            cur.close()
+
+    def __subtree_range(self, prefix):
+        '''
+        Bounds of the key column below prefix, both exclusive
+        '''
+        if self.__to_key is snmprecdb.key_param:
+            key = oidkey.encode(prefix)
+            return (sqlite3.Binary(key), sqlite3.Binary(oidkey.subtree_end(key)))
+        # '/' follows '.' in ASCII
+        sql_prefix = oidkey.to_sql_oid(prefix)
+        return (sql_prefix + '.', sql_prefix + '/')
+
+    def close(self):
+        '''
+        Close the connections of all threads
+        '''
+        with self.__lock:
+            for _, conn in self.__connections:
+                conn.close()
+            self.__connections = []
+        self.__local = threading.local()
 
 
 class FileOIDHandler(OIDBase):
+    # Seconds pending writes stay in the open cache file before a sync
+    sync_interval = 1.0
+
     def __init__(self):
         '''
         Constructor
@@ -142,105 +426,452 @@ class FileOIDHandler(OIDBase):
         self.__sim_file = os.path.join(self.config_instance.snmp_data_dir,
                                        self.config_instance.sim_file)
 
-    def __query_oid_in_cachefile(self, oid):
-        value = ""
-        try:
-            s = shelve.open(self.__cache_file, "r")
-            for key in s.keys():
-                if key == oid:
-                    value = s[key].prettyPrint()
-                    break
-            s.close()
-        except:
-            pass
+        self.__lock = threading.RLock()
+
+        # snmprec files by path, their records are kept in memory and
+        # reloaded when the file changes
+        self.__snmprec_files = {}
+
+        # The cache file stays open, writes are synced by a timer
+        self.__shelf = None
+        self.__sync_timer = None
+
+    @staticmethod
+    def __sim_value(value):
+        if "value" in value:
+            return value.split(',')[0].split('=')[1].strip()
         return value
 
-    def query_oid_val(self, oid):
+    def __snmprec_file(self, path):
+        if path not in self.__snmprec_files:
+            self.__snmprec_files[path] = snmprecfile.SnmprecFile(path)
+        return self.__snmprec_files[path]
+
+    def __sim_records(self):
+        try:
+            return self.__snmprec_file(self.__sim_file).records()
+        except (IOError, OSError) as e:
+            logger.error("Failed to load {0}: {1}".format(self.__sim_file, e))
+            return {}
+
+    def __cache(self):
+        if self.__shelf is None:
+            try:
+                self.__shelf = shelve.open(self.__cache_file, "c")
+            except Exception as e:
+                logger.error("Failed to open cache file {0}: {1}".
+                             format(self.__cache_file, e))
+        return self.__shelf
+
+    def __schedule_sync(self):
+        if self.__sync_timer is None:
+            self.__sync_timer = threading.Timer(self.sync_interval, self.sync)
+            self.__sync_timer.setDaemon(True)
+            self.__sync_timer.start()
+
+    def sync(self):
         '''
-        Query value for oid
+        Write pending changes of the cache file to disk
         '''
-        # Lookup in cache file first
-        value = self.__query_oid_in_cachefile(oid)
-        if value != "":
-            return value
+        with self.__lock:
+            self.__sync_timer = None
+            if self.__shelf is not None:
+                self.__shelf.sync()
 
-        # Lookup in snmprec file
-        # open file
-        try:
-            fdh = open(self.__sim_file, 'rw')
-
-            while True:
-                line = fdh.readline()
-                if not line:
-                    break
-                # oid-type-value
-                record_list = line.strip(os.linesep).split('|')
-                if record_list[0] == oid:
-                    fdh.close()
-                    if "value" in record_list[2]:
-                        val = record_list[2].split(',')[0].split('=')[1].strip()
-                    else:
-                        val = record_list[2]
-                    return val
-        except IOError as e:
-            print e
+    def query_many(self, oids):
+        '''
+        Query values for oids, the cache file first, then the snmprec records
+        '''
+        values = {}
+        with self.__lock:
+            s = self.__cache()
+            records = self.__sim_records()
+            for oid in [str(oid) for oid in oids]:
+                if s is not None and oid in s:
+                    values[oid] = s[oid].prettyPrint()
+                elif oid in records:
+                    values[oid] = self.__sim_value(records[oid][1])
+                else:
+                    logger.error("Not found oid %s" % oid)
+                    values[oid] = ""
+        return values
 
-        logger.error("Not found oid %s" % oid)
-        return ""
+    def query_oid_val(self, oid):
+        '''
+        Query value for oid
+        '''
+        return self.query_many([oid])[str(oid)]
 
-    def __update_oid_in_cachefile(self, oid, val):
-        found = False
-        try:
-            s = shelve.open(self.__cache_file, "rw", writeback=True)
-            for key in s.keys():
-                if oid == key:
-                    found = True
-                    break
-            if found:
-                s[key] = rfc1902.Integer(val, s[key].getTagSet(),
-                                         s[key].getSubtypeSpec(),
-                                         s[key].getNamedValues())
-            else:
-                s[oid] = rfc1902.Integer(val)
+    def update_many(self, oid_vals):
+        '''
+        Update values for oids in the cache file
+        '''
+        with self.__lock:
+            s = self.__cache()
+            if s is None:
+                logger.error("Update oid in cachefile failed.")
+                return
 
-            s.sync()
-            s.close()
-        except:
-            logger.error("Update oid in cachefile failed.")
+            for oid, val in _pairs(oid_vals):
+                oid = str(oid)
+                # The cache file only keeps integers, a value like a mode
+                # or a password is not stored there
+                try:
+                    if oid in s:
+                        old = s[oid]
+                        s[oid] = rfc1902.Integer(val, old.getTagSet(),
+                                                 old.getSubtypeSpec(),
+                                                 old.getNamedValues())
+                    else:
+                        s[oid] = rfc1902.Integer(val)
+                except Exception as e:
+                    logger.error("Update oid {0} in cachefile failed: {1}".
+                                 format(oid, e))
+            self.__schedule_sync()
 
     def update_oid_val(self, oid, val):
         '''
         Update value for oid
         '''
         # update in cache file
-        self.__update_oid_in_cachefile(oid, val)
+        self.update_many([(oid, val)])
+
+    def query_subtree(self, prefix):
+        '''
+        Iterate (oid, value) below prefix, the cache file overrides the
+        snmprec records
+        '''
+        values = []
+        with self.__lock:
+            s = self.__cache()
+            try:
+                rows = self.__snmprec_file(self.__sim_file).subtree(prefix)
+            except (IOError, OSError) as e:
+                logger.error("Failed to load {0}: {1}".
+                             format(self.__sim_file, e))
+                rows = []
+            for oid, (_, value) in rows:
+                if s is not None and oid in s:
+                    values.append((oid, s[oid].prettyPrint()))
+                else:
+                    values.append((oid, self.__sim_value(value)))
+        # The lock is not held while the caller consumes the rows
+        for row in values:
+            yield row
+
+    def query_oid_tag(self, oid):
+        '''
+        Query tag for oid
+        '''
+        with self.__lock:
+            record = self.__sim_records().get(str(oid))
+        if record:
+            return record[0]
+
+    def update_oid_tag(self, oid, tag):
+        '''
+        The cache file keeps typed values, a tag can not be changed alone
+        '''
+        logger.error("Updating tag of {0} is not supported.".format(oid))
+
+    def invalidate(self, oid):
+        '''
+        snmpsimd wrote the cache file, reopen it so the change is visible
+        '''
+        with self.__lock:
+            if self.__shelf is not None:
+                self.__shelf.close()
+                self.__shelf = None
+
+    def close(self):
+        with self.__lock:
+            if self.__sync_timer is not None:
+                self.__sync_timer.cancel()
+                self.__sync_timer = None
+            if self.__shelf is not None:
+                self.__shelf.close()
+                self.__shelf = None
+
+            for snmprec_file in self.__snmprec_files.values():
+                snmprec_file.close()
 
     def update_snmprec_file(self, oid, val):
-        old_file = os.path.join(self.config_instance.snmp_data_dir,
-                                "public.snmprec")
-        new_file = os.path.join(self.config_instance.snmp_data_dir,
-                                "new.snmprec")
+        '''
+        Change a record of public.snmprec, the change is journaled and merged
+        into the file within SnmprecFile.compact_delay seconds, which is
+        when snmpsimd sees it.
+        '''
+        path = os.path.join(self.config_instance.snmp_data_dir,
+                            "public.snmprec")
         logger.info("update oid %s, val %s" % (oid, str(val)))
-        # open file
         try:
-            old_fdh = open(old_file, 'r')
-            new_fdh = open(new_file, 'w')
-            while True:
-                line = old_fdh.readline()
-                if not line:
-                    break
-                record_list = line.strip(os.linesep).split('|')
-                if record_list[0] == oid:
-                    record_list[2] = val
-                    new_line = '|'.join(["%s" % x for x in record_list])
-                    new_fdh.write(new_line + os.linesep)
-                else:
-                    new_fdh.write(line)
-        except IOError as e:
+            with self.__lock:
+                self.__snmprec_file(path).update(str(oid), val)
+        except (IOError, OSError) as e:
             logger.error("Exception in updating snmprec file, exception: {}".
                          format(e))
-            return
 
-        new_fdh.close()
-        old_fdh.close()
-        os.rename(new_file, old_file)
+
+class MmapOIDHandler(OIDBase):
+    '''
+    OIDs served from a compiled, memory-mapped table, see oidmmap.py
+    '''
+
+    def __init__(self, map_file=None):
+        '''
+        Constructor
+        '''
+        super(MmapOIDHandler, self).__init__()
+        self.config_instance = config.get_conf_instance()
+        if map_file is None:
+            map_file = oidmmap.map_path(
+                os.path.join(self.config_instance.snmp_data_dir,
+                             self.config_instance.db_file))
+        self.__table = oidmmap.OIDTable(map_file)
+
+    def query_oid_val(self, oid):
+        '''
+        Query value for oid
+        '''
+        record = self.__table.get(oid)
+        if record:
+            return record[1]
+
+    def query_oid_tag(self, oid):
+        '''
+        Query tag for oid
+        '''
+        record = self.__table.get(oid)
+        if record:
+            return record[0]
+
+    def query_subtree(self, prefix):
+        '''
+        Iterate (oid, value) below prefix, bisecting the mapped file
+        '''
+        for oid, _, value, _ in self.__table.subtree(prefix):
+            yield oid, value
+
+    def update_many(self, oid_vals):
+        '''
+        Update values for oids in a single overlay transaction
+        '''
+        rejected = self.__table.set_many(
+            [(str(oid), _text(val), None) for oid, val in _pairs(oid_vals)])
+        for oid in rejected:
+            logger.error("{0} is not a writable OID.".format(oid))
+
+    def update_oid_val(self, oid, val):
+        '''
+        Update value for oid
+        '''
+        self.update_many([(oid, val)])
+
+    def update_tag_many(self, oid_tags):
+        rejected = []
+        for oid, tag in _pairs(oid_tags):
+            record = self.__table.get(oid)
+            if record is None:
+                rejected.append(oid)
+                continue
+            rejected.extend(self.__table.set_many([(str(oid), record[1], tag)]))
+        for oid in rejected:
+            logger.error("{0} is not a writable OID.".format(oid))
+
+    def update_oid_tag(self, oid, tag):
+        '''
+        Update tag for oid
+        '''
+        self.update_tag_many([(oid, tag)])
+
+    def close(self):
+        self.__table.close()
+
+
+class CachedOIDHandler(OIDBase):
+    '''
+    Bounded read-through cache in front of another OID handler.
+
+    Reads are served from memory after the first lookup, writes go through to
+    the backing handler and refresh the cached entry. Values changed by the
+    SNMP simulator must be dropped with invalidate(), the vPDU does it for
+    every OID reported on the inform pipe.
+
+    Each OID has a generation which invalidate() and writes increment. A
+    read stores what it fetched only if the generation of the OID did not
+    change since its lookup missed, so a read racing with an invalidation
+    can not put the value from before the SET back into the cache.
+    '''
+
+    # Log the counters every report_interval lookups
+    report_interval = 1000
+
+    def __init__(self, oid_handler, max_entries=1024):
+        super(CachedOIDHandler, self).__init__()
+        self.config_instance = oid_handler.config_instance
+        self.__oid_handler = oid_handler
+        self.__max_entries = max_entries
+        self.__entries = collections.OrderedDict()
+        # OID -> generation, OIDs never invalidated or written are at 0
+        self.__generations = {}
+        self.__lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @property
+    def oid_handler(self):
+        return self.__oid_handler
+
+    def stats(self):
+        return {"entries": len(self.__entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations}
+
+    def __lookup(self, key):
+        '''
+        Return (found, value, generation of the OID)
+        '''
+        with self.__lock:
+            found = key in self.__entries
+            if found:
+                value = self.__entries.pop(key)
+                # Move to the most recently used end
+                self.__entries[key] = value
+                self.hits += 1
+            else:
+                value = None
+                self.misses += 1
+            generation = self.__generations.get(key[1], 0)
+            lookups = self.hits + self.misses
+
+        if lookups % self.report_interval == 0:
+            logger.info("OID cache: {0}".format(self.stats()))
+        return found, value, generation
+
+    def __store(self, key, value, generation=None):
+        '''
+        Cache value, a read passes the generation of its lookup and is
+        dropped if the OID was invalidated or written since
+        '''
+        with self.__lock:
+            if generation is None:
+                # A write, reads still in flight are older
+                self.__generations[key[1]] = \
+                    self.__generations.get(key[1], 0) + 1
+            elif self.__generations.get(key[1], 0) != generation:
+                return
+            self.__entries.pop(key, None)
+            self.__entries[key] = value
+            while len(self.__entries) > self.__max_entries:
+                self.__entries.popitem(last=False)
+
+    def __query(self, kind, oid, query):
+        key = (kind, str(oid))
+        found, value, generation = self.__lookup(key)
+        if found:
+            return value
+
+        value = query(oid)
+        self.__store(key, value, generation)
+        return value
+
+    def query_oid_val(self, oid):
+        return self.__query("val", oid, self.__oid_handler.query_oid_val)
+
+    def update_oid_val(self, oid, val):
+        self.update_many([(oid, val)])
+
+    def query_oid_tag(self, oid):
+        return self.__query("tag", oid, self.__oid_handler.query_oid_tag)
+
+    def update_oid_tag(self, oid, tag):
+        self.__oid_handler.update_oid_tag(oid, tag)
+        self.__store(("tag", str(oid)), tag)
+
+    def __query_many(self, kind, oids, query_many):
+        values = {}
+        missed = []
+        generations = {}
+        for oid in oids:
+            found, value, generation = self.__lookup((kind, str(oid)))
+            if found:
+                values[str(oid)] = value
+            else:
+                missed.append(oid)
+                generations[str(oid)] = generation
+
+        if missed:
+            for oid, value in query_many(missed).items():
+                self.__store((kind, oid), value, generations.get(oid, -1))
+                values[oid] = value
+        return values
+
+    def query_many(self, oids):
+        return self.__query_many("val", oids, self.__oid_handler.query_many)
+
+    def update_many(self, oid_vals):
+        oid_vals = _pairs(oid_vals)
+        self.__oid_handler.update_many(oid_vals)
+        for oid, val in oid_vals:
+            # Keep the representation the backing store returns
+            self.__store(("val", str(oid)), _text(val))
+            # Without a mode column the value carries the mode
+            self.__drop(("mode", str(oid)))
+
+    def query_tag_many(self, oids):
+        return self.__query_many("tag", oids,
+                                 self.__oid_handler.query_tag_many)
+
+    def update_tag_many(self, oid_tags):
+        oid_tags = _pairs(oid_tags)
+        self.__oid_handler.update_tag_many(oid_tags)
+        for oid, tag in oid_tags:
+            self.__store(("tag", str(oid)), tag)
+
+    def query_mode_many(self, oids):
+        return self.__query_many("mode", oids,
+                                 self.__oid_handler.query_mode_many)
+
+    def query_oid_mode(self, oid):
+        return self.query_mode_many([oid])[str(oid)]
+
+    def update_mode_many(self, oid_modes):
+        oid_modes = _pairs(oid_modes)
+        self.__oid_handler.update_mode_many(oid_modes)
+        for oid, mode in oid_modes:
+            self.__store(("mode", str(oid)), mode)
+            self.__drop(("val", str(oid)))
+
+    def query_oids_by_mode(self, mode, prefix=None):
+        return self.__oid_handler.query_oids_by_mode(mode, prefix)
+
+    def query_subtree(self, prefix):
+        # Bulk reads go to the backing handler, caching them would only evict
+        # the entries of single lookups.
+        return self.__oid_handler.query_subtree(prefix)
+
+    def __drop(self, key):
+        with self.__lock:
+            if key in self.__entries:
+                del self.__entries[key]
+                return True
+        return False
+
+    def invalidate(self, oid):
+        oid = str(oid)
+        with self.__lock:
+            self.__generations[oid] = self.__generations.get(oid, 0) + 1
+            for kind in ("val", "tag", "mode"):
+                # None is cached for OIDs which are not there
+                if (kind, oid) in self.__entries:
+                    del self.__entries[(kind, oid)]
+                    self.invalidations += 1
+        self.__oid_handler.invalidate(oid)
+
+    def close(self):
+        logger.info("OID cache: {0}".format(self.stats()))
+        with self.__lock:
+            self.__entries.clear()
+        self.__oid_handler.close()
@@ -0,0 +1,335 @@
+'''
+*********************************************************
+Copyright @ 2015 EMC Corporation All Rights Reserved
+*********************************************************
+
+Precompiled, sorted OID table served from a memory-mapped file.
+
+File layout, all integers little endian:
+    header  magic "VPDUOID1", record count (u32), index offset (u32)
+    records keylen (u16), taglen (u8), flags (u8), valuelen (u32),
+            key, tag, value
+    index   one u32 record offset per record, sorted by key
+
+Keys are encoded with common/oidkey.py, so an exact lookup and the search
+for the successor of an OID are binary searches over the index. The file
+is never written after it is compiled; processes mapping it share the
+page cache.
+
+Writable records are changed in a small SQLite overlay next to the file
+(<file>.overlay), which every process keeps in memory and reloads when
+another process commits to it.
+'''
+import os
+import mmap
+import sqlite3
+import struct
+import threading
+import common.oidkey as oidkey
+import snmprecdb
+
+MAGIC = b"VPDUOID1"
+HEADER = struct.Struct("<8sII")
+RECORD = struct.Struct("<HBBI")
+OFFSET = struct.Struct("<I")
+
+FLAG_WRITABLE = 0x01
+
+
+def compile_records(records, dst):
+    '''
+    Write records, an iterable of (oid, tag, value, writable), to dst.
+    Return the number of records.
+    '''
+    entries = [(oidkey.encode(oid), str(tag), str(value), writable)
+               for oid, tag, value, writable in records]
+    entries.sort()
+
+    tmp = dst + ".tmp"
+    with open(tmp, "wb") as fdh:
+        fdh.write(HEADER.pack(MAGIC, 0, 0))
+        offsets = []
+        offset = HEADER.size
+        for key, tag, value, writable in entries:
+            flags = FLAG_WRITABLE if writable else 0
+            fdh.write(RECORD.pack(len(key), len(tag), flags, len(value)))
+            fdh.write(key)
+            fdh.write(tag)
+            fdh.write(value)
+            offsets.append(offset)
+            offset += RECORD.size + len(key) + len(tag) + len(value)
+        for record_offset in offsets:
+            fdh.write(OFFSET.pack(record_offset))
+        fdh.seek(0)
+        fdh.write(HEADER.pack(MAGIC, len(entries), offset))
+    # Processes which mapped the former file keep their copy
+    os.rename(tmp, dst)
+    return len(entries)
+
+
+def compile_snmprec(src, dst):
+    '''
+    Compile a .snmprec file, records referring to variation modules are
+    skipped.
+    '''
+    def records():
+        with open(src, "r") as fdh:
+            for line in fdh:
+                record = line.rstrip("\r\n").split("|", 2)
+                if len(record) != 3 or ":" in record[1]:
+                    continue
+                yield record[0], record[1], record[2], True
+    return compile_records(records(), dst)
+
+
+def compile_sqlite(src, dst, table="snmprec"):
+    '''
+    Compile an snmprec table of a SQLite database, a separate mode column
+    is folded back into the value the way legacy tables store it
+    '''
+    conn = sqlite3.connect(src)
+    try:
+        if snmprecdb.has_mode(conn, table):
+            rows = conn.execute("select oid, tag, value, maxaccess, %s "
+                                "from %s" % (snmprecdb.MODE_COLUMN, table))
+        else:
+            rows = conn.execute("select oid, tag, value, maxaccess, null "
+                                "from %s" % table)
+        return compile_records(
+            [(oidkey.from_sql_oid(oid), tag, snmprecdb.join_mode(mode, value),
+              maxaccess == "read-write")
+             for oid, tag, value, maxaccess, mode in rows], dst)
+    finally:
+        conn.close()
+
+
+def compile_file(src, dst):
+    '''
+    Compile a .snmprec file or a SQLite database holding an snmprec table
+    '''
+    if src.endswith(".snmprec"):
+        return compile_snmprec(src, dst)
+    return compile_sqlite(src, dst)
+
+
+def map_path(src):
+    '''
+    Path of the file compiled from src
+    '''
+    return os.path.splitext(src)[0] + ".oidmap"
+
+
+def is_stale(src, dst):
+    '''
+    True if dst has to be compiled from src
+    '''
+    return not os.path.exists(dst) or \
+        os.stat(dst).st_mtime < os.stat(src).st_mtime
+
+
+class OIDMap(object):
+    '''
+    Read-only view of a compiled file
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as fdh:
+            self.__mm = mmap.mmap(fdh.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self.__index = HEADER.unpack_from(self.__mm, 0)
+        if magic != MAGIC:
+            self.__mm.close()
+            raise ValueError("{0} is not a compiled OID table".format(path))
+
+    def __offset(self, i):
+        return OFFSET.unpack_from(self.__mm, self.__index + i * 4)[0]
+
+    def key(self, i):
+        offset = self.__offset(i)
+        keylen = RECORD.unpack_from(self.__mm, offset)[0]
+        start = offset + RECORD.size
+        return self.__mm[start:start + keylen]
+
+    def record(self, i):
+        '''
+        Return (key, tag, value, writable) of the i-th record in OID order
+        '''
+        offset = self.__offset(i)
+        keylen, taglen, flags, valuelen = RECORD.unpack_from(self.__mm, offset)
+        start = offset + RECORD.size
+        key = self.__mm[start:start + keylen]
+        start += keylen
+        tag = self.__mm[start:start + taglen]
+        start += taglen
+        value = self.__mm[start:start + valuelen]
+        return key, tag, value, bool(flags & FLAG_WRITABLE)
+
+    def bisect(self, key, right=False):
+        '''
+        Index where key would be inserted, after an equal key if right
+        '''
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            k = self.key(mid)
+            if k < key or (right and k == key):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def find(self, key):
+        '''
+        Index of the record with key, None if there is none
+        '''
+        i = self.bisect(key)
+        if i < self.count and self.key(i) == key:
+            return i
+        return None
+
+    def successor(self, key):
+        '''
+        Index of the first record after key, None at the end of the table
+        '''
+        i = self.bisect(key, right=True)
+        if i < self.count:
+            return i
+        return None
+
+    def close(self):
+        self.__mm.close()
+
+
+class Overlay(object):
+    '''
+    Values written to a compiled file, shared through a SQLite database
+    '''
+
+    def __init__(self, path, timeout=10):
+        self.path = path
+        self.__conn = sqlite3.connect(path, timeout=timeout,
+                                      check_same_thread=False)
+        self.__conn.execute("PRAGMA journal_mode=WAL")
+        self.__conn.execute("create table if not exists overlay "
+                            "(okey blob primary key, tag text, value text)")
+        self.__conn.commit()
+        self.__lock = threading.Lock()
+        self.__entries = {}
+        self.__version = None
+
+    def __refresh(self):
+        # data_version only changes when another connection commits
+        version = self.__conn.execute("PRAGMA data_version").fetchone()[0]
+        if version != self.__version:
+            self.__entries = dict(
+                [(bytes(key), (str(tag), str(value))) for key, tag, value in
+                 self.__conn.execute("select okey, tag, value from overlay")])
+            self.__version = version
+
+    def get(self, key):
+        '''
+        Return (tag, value) written for key, None if it was never written
+        '''
+        with self.__lock:
+            self.__refresh()
+            return self.__entries.get(key)
+
+    def set_many(self, entries):
+        '''
+        Write (key, tag, value) entries in one transaction
+        '''
+        entries = list(entries)
+        with self.__lock:
+            self.__refresh()
+            self.__conn.executemany(
+                "insert or replace into overlay (okey, tag, value) "
+                "values (?, ?, ?)",
+                [(sqlite3.Binary(key), tag, value)
+                 for key, tag, value in entries])
+            self.__conn.commit()
+            for key, tag, value in entries:
+                self.__entries[key] = (tag, value)
+
+    def set(self, key, tag, value):
+        self.set_many([(key, tag, value)])
+
+    def close(self):
+        with self.__lock:
+            self.__conn.close()
+
+
+class OIDTable(object):
+    '''
+    Compiled file with its overlay applied
+    '''
+
+    def __init__(self, path):
+        self.map = OIDMap(path)
+        self.overlay = Overlay(path + ".overlay")
+
+    def __resolve(self, i):
+        key, tag, value, writable = self.map.record(i)
+        if writable:
+            written = self.overlay.get(key)
+            if written:
+                tag, value = written
+        return key, tag, value, writable
+
+    def get(self, oid):
+        '''
+        Return (tag, value, writable) of oid, None if it is not in the table
+        '''
+        i = self.map.find(oidkey.encode(oid))
+        if i is None:
+            return None
+        return self.__resolve(i)[1:]
+
+    def get_next(self, oid):
+        '''
+        Return (oid, tag, value, writable) of the first OID after oid, None
+        at the end of the table
+        '''
+        i = self.map.successor(oidkey.encode(oid))
+        if i is None:
+            return None
+        key, tag, value, writable = self.__resolve(i)
+        return oidkey.decode(key), tag, value, writable
+
+    def subtree(self, prefix):
+        '''
+        Iterate (oid, tag, value, writable) of the OIDs below prefix in OID
+        order
+        '''
+        key = oidkey.encode(prefix)
+        start = self.map.bisect(key, right=True)
+        end = self.map.bisect(oidkey.subtree_end(key))
+        for i in xrange(start, end):
+            key, tag, value, writable = self.__resolve(i)
+            yield oidkey.decode(key), tag, value, writable
+
+    def set(self, oid, value, tag=None):
+        self.set_many([(oid, value, tag)])
+
+    def set_many(self, entries):
+        '''
+        Write (oid, value, tag) entries, tag None keeps the current tag.
+        Return the OIDs which are not in the table or not writable.
+        '''
+        writes = []
+        rejected = []
+        for oid, value, tag in entries:
+            key = oidkey.encode(oid)
+            i = self.map.find(key)
+            if i is None or not self.map.record(i)[3]:
+                rejected.append(oid)
+                continue
+            if tag is None:
+                tag = self.__resolve(i)[1]
+            writes.append((key, tag, value))
+        if writes:
+            self.overlay.set_many(writes)
+        return rejected
+
+    def close(self):
+        self.overlay.close()
+        self.map.close()
@@ -0,0 +1,67 @@
+'''
+*********************************************************
+Copyright @ 2015 EMC Corporation All Rights Reserved
+*********************************************************
+
+Routing of the varbinds written by snmpset to the PDUs handling them.
+
+The vendors register the writable OID columns of their PDUs, an OID below a
+column is routed to (PDU, handler, outlet) with one dict lookup of the
+column, the outlet being the last component of the OID. The cost does not
+depend on the number of PDUs or columns registered.
+'''
+import collections
+import common.logger as logger
+
+
+class OIDRouter(object):
+
+    def __init__(self):
+        # column -> (pdu, handler)
+        self.__routes = {}
+
+    def register(self, column, pdu, handler):
+        '''
+        Route the OIDs <column>.<outlet> to handler of pdu, which is called
+        with (outlet, value)
+        '''
+        column = column.strip(".")
+        if column in self.__routes:
+            raise ValueError("{0} is routed already".format(column))
+        self.__routes[column] = (pdu, handler)
+
+    def columns(self):
+        return sorted(self.__routes.keys())
+
+    def route(self, oid):
+        '''
+        Return (pdu, handler, outlet) of oid, None if no column of it is
+        registered
+        '''
+        column, _, outlet = oid.strip(".").rpartition(".")
+        entry = self.__routes.get(column)
+        if entry is None or not outlet.isdigit():
+            return None
+        return entry + (int(outlet),)
+
+    def dispatch(self, varbinds):
+        '''
+        Queue the (oid, value) varbinds of a SET PDU as one plan per outlet,
+        with the steps in the order they were set. The outlets run
+        concurrently, see workers.py.
+        '''
+        plans = collections.OrderedDict()
+        for oid, value in varbinds:
+            entry = self.route(oid)
+            if entry is None:
+                logger.warn("{0} is not handled now.".format(oid))
+                continue
+            pdu, handler, outlet = entry
+            plans.setdefault((pdu, outlet), []).append(
+                (handler, (outlet, value)))
+
+        for (pdu, outlet), steps in plans.items():
+            # handle_outlet,handle_password-4
+            name = "{0}-{1}".format(
+                ",".join([func.__name__ for func, _ in steps]), outlet)
+            pdu.add_plan(name, steps, outlet)
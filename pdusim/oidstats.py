@@ -0,0 +1,131 @@
+'''
+*********************************************************
+Copyright @ 2015 EMC Corporation All Rights Reserved
+*********************************************************
+
+Access counters and latency histograms per OID prefix.
+
+The variation modules record every variate() call, dump() writes the
+numbers to a JSON file which the vPDU CLI reads with load(). Recording
+only increments counters of a dict entry, everything else is done when
+dumping or displaying.
+'''
+import os
+import json
+import time
+import bisect
+
+GET = 0
+GETNEXT = 1
+SET = 2
+
+OPERATIONS = ["get", "getnext", "set"]
+
+# Upper bounds of the latency buckets in microseconds, the last bucket
+# takes everything above
+BUCKETS = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000]
+
+
+def prefix(oid, components=0):
+    '''
+    Return the prefix of oid the calls are counted for, the first components
+    of oid, or oid without its last component, the instance, for 0
+    '''
+    oid = tuple(oid)
+    if components > 0:
+        return oid[:components]
+    return oid[:-1]
+
+
+class OIDStats(object):
+    '''
+    Not thread safe, the caller serializes record() and snapshot()
+    '''
+
+    def __init__(self, components=0):
+        self.components = components
+        self.started = time.time()
+        # prefix -> [[get, getnext, set], latency sum, histogram]
+        self.__prefixes = {}
+
+    def record(self, oid, operation, seconds):
+        key = prefix(oid, self.components)
+        entry = self.__prefixes.get(key)
+        if entry is None:
+            entry = self.__prefixes[key] = \
+                [[0, 0, 0], 0.0, [0] * (len(BUCKETS) + 1)]
+        entry[0][operation] += 1
+        entry[1] += seconds
+        entry[2][bisect.bisect_left(BUCKETS, seconds * 1000000)] += 1
+
+    def snapshot(self):
+        '''
+        Return the statistics as a dict which can be written as JSON
+        '''
+        prefixes = {}
+        for key, (counts, latency, histogram) in self.__prefixes.items():
+            prefixes[".".join([str(c) for c in key])] = {
+                "counts": dict(zip(OPERATIONS, counts)),
+                "latency": latency,
+                "histogram": list(histogram)
+            }
+        return {"started": self.started,
+                "time": time.time(),
+                "buckets": BUCKETS,
+                "prefixes": prefixes}
+
+
+def dump(stats, stats_file):
+    '''
+    Write a snapshot() to stats_file, readers never see a partial file
+    '''
+    tmp_file = stats_file + ".tmp"
+    with open(tmp_file, "w") as fd:
+        json.dump(stats, fd)
+    os.rename(tmp_file, stats_file)
+
+
+def load(stats_file):
+    '''
+    Read the statistics written by dump(), None if there are none
+    '''
+    try:
+        with open(stats_file, "r") as fd:
+            return json.load(fd)
+    except (IOError, ValueError):
+        return None
+
+
+def percentile(histogram, fraction):
+    '''
+    Return the upper bound in microseconds of the bucket holding the given
+    fraction of the calls, None if it is the open last bucket
+    '''
+    total = sum(histogram)
+    if total == 0:
+        return 0
+    needed = fraction * total
+    count = 0
+    for i, n in enumerate(histogram):
+        count += n
+        if count >= needed:
+            break
+    return BUCKETS[i] if i < len(BUCKETS) else None
+
+
+def hottest(stats, limit=None):
+    '''
+    Return (prefix, counts, average latency in microseconds, p50, p99) of
+    the prefixes of a snapshot, the most called first
+    '''
+    rows = []
+    for key, entry in stats["prefixes"].items():
+        counts = entry["counts"]
+        calls = sum(counts.values())
+        if calls == 0:
+            continue
+        rows.append((key, counts, entry["latency"] * 1000000 / calls,
+                     percentile(entry["histogram"], 0.5),
+                     percentile(entry["histogram"], 0.99)))
+    rows.sort(key=lambda row: sum(row[1].values()), reverse=True)
+    return rows[:limit] if limit else rows
@@ -5,13 +5,19 @@ import common.helper as helper
 helper.add_third_party_to_path()
 
 import common.config as config
-from oid import FileOIDHandler, SqliteOIDHandler
+from oid import FileOIDHandler, SqliteOIDHandler, MmapOIDHandler, \
+    CachedOIDHandler
 import common.logger as logger
 import vsentry as vsentry
 import vipiapp as vipiapp
 from vmware import VMwareHandler
 from sss import SNMPSimService
 import common.pipe as pipe
+import common.channel as channel
+import workers
+import socket
+import snmprecdb
+import oidmmap
 import mapping_file as mapping_file
 import multiprocessing
 
@@ -32,7 +38,14 @@ class PDUSim(multiprocessing.Process):
             logger.error("Don't find the configuration dir.")
             sys.exit(1)
 
-        p = pipe.Pipe()
+        try:
+            listener = channel.Listener()
+            channel.set_listener(listener)
+        except socket.error as e:
+            logger.warn("No channel to snmpsimd, informs only come over "
+                        "the pipe: {0}".format(e))
+            listener = None
+        p = pipe.Pipe(listener)
 
         conf = config.Config(dir)
         config.set_conf_instance(conf)
@@ -47,17 +60,39 @@ class PDUSim(multiprocessing.Process):
 
         db_type = conf.db_type
         # Create OID handler
-        if db_type == "SQLITE":
+        if db_type in ("SQLITE", "MEMORY"):
+            # With MEMORY snmpsimd serves the database from memory and
+            # snapshots it, the vPDU still works on the database
+            db_path = os.path.join(conf.snmp_data_dir, conf.db_file)
+            if os.path.exists(db_path) and \
+                    snmprecdb.upgrade(db_path, conf.default_table_name):
+                logger.info("Database {} is upgraded.".format(db_path))
             oid_handler = SqliteOIDHandler()
         elif db_type == "WRITECACHE":
             oid_handler = FileOIDHandler()
+        elif db_type == "MMAP":
+            # The database is compiled into a sorted table shared by
+            # snmpsimd and the vPDU
+            db_path = os.path.join(conf.snmp_data_dir, conf.db_file)
+            map_path = oidmmap.map_path(db_path)
+            if oidmmap.is_stale(db_path, map_path):
+                count = oidmmap.compile_file(db_path, map_path)
+                logger.info("Compiled {0} records of {1} into {2}.".
+                            format(count, db_path, map_path))
+            oid_handler = MmapOIDHandler(map_path)
         else:
             logger.error("DB type {} is not supported!".format(db_type))
             sys.exit(1)
 
+        # Outlet OIDs are read over and over, serve the repeats from memory
+        oid_handler = CachedOIDHandler(oid_handler)
+
         # Create VM handler
         vm_handler = VMwareHandler()
 
+        # The PDUs share one pool of threads for their outlet actions
+        workers.set_pool(workers.WorkerPool(conf.workers))
+
         # Create vPDU instance.
         if pdu_device == "SENTRY":
             self.__vpdu_handler = vsentry.vSentry(oid_handler, vm_handler, p)
@@ -75,6 +110,8 @@ class PDUSim(multiprocessing.Process):
             sys.exit(1)
 
         self.__vpdu_handler.main_loop()
+        logger.info("Worker pool: {0}".format(workers.get_pool().stats()))
+        workers.get_pool().close()
 
     def stop(self):
         if self.__vpdu_handler:
@@ -0,0 +1,278 @@
+'''
+*********************************************************
+Copyright @ 2015 EMC Corporation All Rights Reserved
+*********************************************************
+
+Schema helpers for the SQLite databases holding snmprec records.
+
+The layout created by snmpsim is:
+    CREATE TABLE <table> (oid text, tag text, value text, maxaccess text)
+with the OID in the space-padded text form and no index, and the mode of
+writable outlets folded into the value as 'mode=<mode>,value=<value>'.
+
+upgrade() adds
+    okey    the encoded OID (see common/oidkey.py) with a unique index
+    mode    the outlet mode split off the value, with an index
+    version a counter a trigger increments whenever tag, value or mode of
+            the row is updated, by any connection
+Databases which were not upgraded keep working with the legacy layout,
+readers check it with has_oid_key(), has_mode() and has_version().
+
+import_snmprec() and export_snmprec() convert between .snmprec files and
+the upgraded table.
+'''
+import os
+import sqlite3
+import common.oidkey as oidkey
+import snmprecfile
+
+OID_KEY_COLUMN = "okey"
+MODE_COLUMN = "mode"
+VERSION_COLUMN = "version"
+
+# Rows updated per statement batch while filling a new column
+UPGRADE_CHUNK = 2000
+
+# Rows inserted per statement batch while importing a .snmprec file
+IMPORT_CHUNK = 5000
+
+
+def columns(conn, table):
+    return [row[1] for row in
+            conn.execute('PRAGMA table_info(%s)' % table).fetchall()]
+
+
+def has_oid_key(conn, table):
+    return OID_KEY_COLUMN in columns(conn, table)
+
+
+def has_mode(conn, table):
+    return MODE_COLUMN in columns(conn, table)
+
+
+def has_version(conn, table):
+    return VERSION_COLUMN in columns(conn, table)
+
+
+def key_param(oid):
+    '''
+    Bind parameter for the encoded key of oid
+    '''
+    return sqlite3.Binary(oidkey.encode(oid))
+
+
+def split_mode(value):
+    '''
+    Split a legacy 'mode=<mode>,value=<value>' value into (mode, value), a
+    value without mode gives (None, value).
+    '''
+    if not isinstance(value, basestring) or not value.startswith('mode='):
+        return None, value
+    try:
+        settings = dict([x.split('=', 1) for x in value.split(',')])
+    except ValueError:
+        return None, value
+    return settings.get('mode'), settings.get('value', '')
+
+
+def join_mode(mode, value):
+    '''
+    Legacy value carrying mode, the reverse of split_mode()
+    '''
+    if mode is None:
+        return value
+    return 'mode=' + mode + ',value=' + str(value)
+
+
+def create_oid_key_index(conn, table):
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS %s_%s ON %s (%s)' %
+                 (table, OID_KEY_COLUMN, table, OID_KEY_COLUMN))
+
+
+def create_mode_index(conn, table):
+    conn.execute('CREATE INDEX IF NOT EXISTS %s_%s ON %s (%s)' %
+                 (table, MODE_COLUMN, table, MODE_COLUMN))
+
+
+def create_version_trigger(conn, table):
+    # The update of the trigger does not fire it again, it only sets version
+    conn.execute('CREATE TRIGGER IF NOT EXISTS %s_%s '
+                 'AFTER UPDATE OF tag, value, %s ON %s BEGIN '
+                 'UPDATE %s SET %s = %s + 1 WHERE rowid = NEW.rowid; END' %
+                 (table, VERSION_COLUMN, MODE_COLUMN, table,
+                  table, VERSION_COLUMN, VERSION_COLUMN))
+
+
+def _fill_column(conn, table, statement, rows):
+    for start in range(0, len(rows), UPGRADE_CHUNK):
+        conn.executemany(statement % table, rows[start:start + UPGRADE_CHUNK])
+
+
+def _upgrade(conn, table):
+    existing = columns(conn, table)
+    changed = False
+
+    if OID_KEY_COLUMN not in existing:
+        conn.execute('ALTER TABLE %s ADD COLUMN %s BLOB' %
+                     (table, OID_KEY_COLUMN))
+        rows = conn.execute('SELECT rowid, oid FROM %s' % table).fetchall()
+        _fill_column(conn, table, 'UPDATE %s SET okey=? WHERE rowid=?',
+                     [(key_param(oidkey.from_sql_oid(oid)), rowid)
+                      for rowid, oid in rows])
+        create_oid_key_index(conn, table)
+        changed = True
+
+    if MODE_COLUMN not in existing:
+        conn.execute('ALTER TABLE %s ADD COLUMN %s TEXT' %
+                     (table, MODE_COLUMN))
+        rows = conn.execute('SELECT rowid, value FROM %s '
+                            'WHERE value LIKE \'mode=%%\'' %
+                            table).fetchall()
+        _fill_column(conn, table,
+                     'UPDATE %s SET mode=?, value=? WHERE rowid=?',
+                     [split_mode(value) + (rowid,)
+                      for rowid, value in rows])
+        create_mode_index(conn, table)
+        changed = True
+
+    if VERSION_COLUMN not in existing:
+        conn.execute('ALTER TABLE %s ADD COLUMN %s INTEGER NOT NULL '
+                     'DEFAULT 0' % (table, VERSION_COLUMN))
+        create_version_trigger(conn, table)
+        changed = True
+    return changed
+
+
+def _connect(db_file):
+    '''
+    Connection to db_file in WAL mode which leaves transactions to the
+    caller. The sqlite3 module would commit before every DDL statement.
+    '''
+    conn = sqlite3.connect(db_file, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    return conn
+
+
+def _transaction(conn, func, *args):
+    '''
+    Return func(conn, *args) run in one transaction, rolled back if func
+    raises
+    '''
+    conn.execute('BEGIN')
+    try:
+        result = func(conn, *args)
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+    return result
+
+
+def upgrade(db_file, table="snmprec"):
+    '''
+    Add the encoded OID key, mode and version columns with their indexes
+    and trigger to db_file in one transaction, and switch the database to
+    WAL journaling. Columns which exist already are left alone. Return True
+    if the schema was changed.
+    '''
+    conn = _connect(db_file)
+    try:
+        return _transaction(conn, _upgrade, table)
+    finally:
+        conn.close()
+
+
+def create_table(conn, table):
+    '''
+    Create the upgraded snmprec table with its version trigger, the indexes
+    are created separately
+    '''
+    conn.execute('CREATE TABLE IF NOT EXISTS %s (oid text, tag text, '
+                 'value text, maxaccess text, %s BLOB, %s TEXT, '
+                 '%s INTEGER NOT NULL DEFAULT 0)' %
+                 (table, OID_KEY_COLUMN, MODE_COLUMN, VERSION_COLUMN))
+    create_version_trigger(conn, table)
+
+
+def _snmprec_rows(src, maxaccess):
+    with open(src, 'r') as fdh:
+        for line in fdh:
+            record = snmprecfile.SnmprecFile.parse(line)
+            # Records referring to variation modules can not be served from
+            # the table
+            if not record or ':' in record[1]:
+                continue
+            oid, tag, value = record
+            mode, value = split_mode(value)
+            yield (oidkey.to_sql_oid(oid), tag, value, maxaccess,
+                   key_param(oid), mode)
+
+
+def import_snmprec(src, db_file, table="snmprec", maxaccess="read-write"):
+    '''
+    Load the records of the .snmprec file src into table of db_file,
+    replacing its rows. The file is streamed in chunks within a single
+    transaction and the indexes are built once at the end. Return the number
+    of rows. If the import fails, for example on a duplicate OID, the table
+    is left as it was.
+    '''
+    conn = _connect(db_file)
+    try:
+        return _transaction(conn, _import, src, table, maxaccess)
+    finally:
+        conn.close()
+
+
+def _import(conn, src, table, maxaccess):
+    if columns(conn, table):
+        conn.execute('DELETE FROM %s' % table)
+        _upgrade(conn, table)
+    else:
+        create_table(conn, table)
+    # Filling the indexes row by row is much slower than building them
+    conn.execute('DROP INDEX IF EXISTS %s_%s' % (table, OID_KEY_COLUMN))
+    conn.execute('DROP INDEX IF EXISTS %s_%s' % (table, MODE_COLUMN))
+
+    statement = 'INSERT INTO %s (oid, tag, value, maxaccess, %s, %s) ' \
+        'VALUES (?, ?, ?, ?, ?, ?)' % (table, OID_KEY_COLUMN, MODE_COLUMN)
+    count = 0
+    chunk = []
+    for row in _snmprec_rows(src, maxaccess):
+        chunk.append(row)
+        if len(chunk) == IMPORT_CHUNK:
+            conn.executemany(statement, chunk)
+            count += len(chunk)
+            chunk = []
+    if chunk:
+        conn.executemany(statement, chunk)
+        count += len(chunk)
+
+    create_oid_key_index(conn, table)
+    create_mode_index(conn, table)
+    return count
+
+
+def export_snmprec(db_file, dst, table="snmprec"):
+    '''
+    Write the rows of table in db_file to the .snmprec file dst in OID
+    order, with the mode folded back into the value. Return the number of
+    records.
+    '''
+    conn = sqlite3.connect(db_file)
+    try:
+        existing = columns(conn, table)
+        mode = MODE_COLUMN if MODE_COLUMN in existing else 'NULL'
+        order = OID_KEY_COLUMN if OID_KEY_COLUMN in existing else 'oid'
+        rows = conn.execute('SELECT oid, tag, value, %s FROM %s ORDER BY %s' %
+                            (mode, table, order))
+        count = 0
+        tmp = dst + ".tmp"
+        with open(tmp, 'w') as fdh:
+            for oid, tag, value, mode in rows:
+                fdh.write('|'.join([oidkey.from_sql_oid(oid), str(tag),
+                                    str(join_mode(mode, value))]) + '\n')
+                count += 1
+        os.rename(tmp, dst)
+        return count
+    finally:
+        conn.close()
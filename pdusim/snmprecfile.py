@@ -0,0 +1,241 @@
+'''
+*********************************************************
+Copyright @ 2015 EMC Corporation All Rights Reserved
+*********************************************************
+'''
+import os
+import bisect
+import threading
+import common.logger as logger
+import common.oidkey as oidkey
+
+
+class SnmprecFile(object):
+    '''
+    snmprec file with an append-only change journal.
+
+    A change is appended to <file>.journal as a regular snmprec record
+    instead of rewriting the whole file. Readers get the records of the file
+    overlaid with the journal. The journal is merged back into the file by
+    compact(), in the background compact_delay seconds after the first
+    change since the last compaction or as soon as it grows beyond
+    compact_threshold records, and when the file is closed. Readers of the
+    plain file like snmpsimd see a change after at most compact_delay
+    seconds, a burst of changes costs one rewrite.
+
+    The vPDU process is expected to be the only writer of the journal.
+    '''
+
+    # Journal records which trigger a background compaction
+    compact_threshold = 1000
+
+    # Seconds changes stay in the journal before a background compaction
+    compact_delay = 1.0
+
+    def __init__(self, path):
+        self.path = path
+        self.journal_path = path + ".journal"
+        self.__lock = threading.RLock()
+        self.__records = {}
+        # Encoded keys and OIDs of the records in OID order, built on demand
+        self.__keys = None
+        self.__oids = None
+        self.__base_mtime = None
+        self.__journal_offset = 0
+        self.__journal_records = 0
+        self.__compactor = None
+        self.__compact_timer = None
+
+    @staticmethod
+    def parse(line):
+        '''
+        Split a snmprec line into [oid, tag, value], None if malformed
+        '''
+        record = line.rstrip('\r\n').split('|', 2)
+        if len(record) == 3:
+            return record
+        return None
+
+    def __journal_size(self):
+        try:
+            return os.stat(self.journal_path).st_size
+        except OSError:
+            return 0
+
+    def __read_journal(self, offset):
+        '''
+        Apply the journal from offset to the in-memory records
+        '''
+        try:
+            with open(self.journal_path, 'r') as fdh:
+                fdh.seek(offset)
+                for line in fdh:
+                    # Ignore a partially written last line
+                    if not line.endswith('\n'):
+                        break
+                    offset += len(line)
+                    record = self.parse(line)
+                    if record:
+                        if record[0] not in self.__records:
+                            self.__keys = None
+                        self.__records[record[0]] = (record[1], record[2])
+                        self.__journal_records += 1
+        except IOError:
+            pass
+        self.__journal_offset = offset
+
+    def records(self):
+        '''
+        Return a dict oid -> (tag, value) of the file overlaid with the
+        journal. Raise IOError/OSError if the file can not be read.
+        '''
+        with self.__lock:
+            mtime = os.stat(self.path).st_mtime
+            journal_size = self.__journal_size()
+            if mtime != self.__base_mtime or \
+                    journal_size < self.__journal_offset:
+                records = {}
+                with open(self.path, 'r') as fdh:
+                    for line in fdh:
+                        record = self.parse(line)
+                        if record:
+                            records[record[0]] = (record[1], record[2])
+                self.__records = records
+                self.__keys = None
+                self.__base_mtime = mtime
+                self.__journal_offset = 0
+                self.__journal_records = 0
+
+            if journal_size > self.__journal_offset:
+                self.__read_journal(self.__journal_offset)
+            return self.__records
+
+    def subtree(self, prefix):
+        '''
+        Return [(oid, (tag, value))] of the records below prefix in OID order
+        '''
+        with self.__lock:
+            records = self.records()
+            if self.__keys is None:
+                index = sorted([(oidkey.encode(oid), oid) for oid in records])
+                self.__keys = [key for key, _ in index]
+                self.__oids = [oid for _, oid in index]
+            key = oidkey.encode(prefix)
+            start = bisect.bisect_right(self.__keys, key)
+            end = bisect.bisect_left(self.__keys, oidkey.subtree_end(key))
+            return [(oid, records[oid]) for oid in self.__oids[start:end]]
+
+    def update(self, oid, val):
+        '''
+        Change the value of an existing record with one journal append.
+        Return False if oid is not in the file.
+        '''
+        with self.__lock:
+            records = self.records()
+            if oid not in records:
+                return False
+
+            tag = records[oid][0]
+            line = '|'.join([oid, tag, str(val)]) + '\n'
+            with open(self.journal_path, 'a') as fdh:
+                fdh.write(line)
+
+            records[oid] = (tag, str(val))
+            self.__journal_offset += len(line)
+            self.__journal_records += 1
+
+            if self.__journal_records >= self.compact_threshold:
+                self.compact_in_background()
+            else:
+                self.__schedule_compact()
+            return True
+
+    def __schedule_compact(self):
+        if self.__compact_timer is None:
+            self.__compact_timer = threading.Timer(self.compact_delay,
+                                                   self.compact_in_background)
+            self.__compact_timer.setDaemon(True)
+            self.__compact_timer.start()
+
+    def compact_in_background(self):
+        with self.__lock:
+            if self.__compact_timer is not None:
+                self.__compact_timer.cancel()
+                self.__compact_timer = None
+            if self.__compactor and self.__compactor.is_alive():
+                # What is journaled meanwhile is compacted after it
+                self.__schedule_compact()
+                return
+            self.__compactor = threading.Thread(target=self.compact,
+                                                name="snmprec-compactor")
+            self.__compactor.setDaemon(True)
+            self.__compactor.start()
+
+    def compact(self):
+        '''
+        Merge the journal into the file.
+
+        The file is rewritten from a snapshot without holding the lock, so
+        readers and writers are not blocked meanwhile. Records journaled
+        during the rewrite are carried over into a new journal.
+        '''
+        with self.__lock:
+            try:
+                records = dict(self.records())
+            except (IOError, OSError) as e:
+                logger.error("Failed to compact {0}: {1}".format(self.path, e))
+                return
+            if self.__journal_offset == 0:
+                return
+            offset = self.__journal_offset
+
+        new_file = self.path + ".compact"
+        try:
+            with open(self.path, 'r') as old_fdh:
+                with open(new_file, 'w') as new_fdh:
+                    for line in old_fdh:
+                        record = self.parse(line)
+                        if record and record[0] in records and \
+                                tuple(record[1:]) != records[record[0]]:
+                            line = '|'.join([record[0]] +
+                                            list(records[record[0]])) + '\n'
+                        new_fdh.write(line)
+        except IOError as e:
+            logger.error("Failed to compact {0}: {1}".format(self.path, e))
+            return
+
+        with self.__lock:
+            # Keep what was journaled while the file was rewritten
+            tail = ""
+            try:
+                with open(self.journal_path, 'r') as fdh:
+                    fdh.seek(offset)
+                    tail = fdh.read()
+            except IOError:
+                pass
+
+            os.rename(new_file, self.path)
+            if tail:
+                new_journal = self.journal_path + ".new"
+                with open(new_journal, 'w') as fdh:
+                    fdh.write(tail)
+                os.rename(new_journal, self.journal_path)
+            elif os.path.exists(self.journal_path):
+                os.remove(self.journal_path)
+
+            # Force a reload on the next access
+            self.__base_mtime = None
+            logger.info("{0} is compacted.".format(self.path))
+
+    def close(self):
+        '''
+        Wait for a background compaction and merge the rest of the journal
+        '''
+        with self.__lock:
+            if self.__compact_timer is not None:
+                self.__compact_timer.cancel()
+                self.__compact_timer = None
+        compactor = self.__compactor
+        if compactor:
+            compactor.join()
+        self.compact()
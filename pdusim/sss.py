@@ -7,11 +7,36 @@ import os
 import subprocess
 import time
 import signal
+import glob
+import shutil
 import common.logger as logger
 import common.config as config
+import oidmmap
+import common.channel as channel
 
 snmpsim_pid_file = "/var/run/snmpsim/snmpsimd.pid"
 
+# Data files redirecting every community to the mmapdb variation module
+mmap_data_dir = "/var/run/snmpsim/mmap"
+
+# Data files routing the communities of the tenants to their databases
+tenants_data_dir = "/var/run/snmpsim/tenants"
+
+# Rows the sql variation module reads ahead for GETNEXT and GETBULK. A walk
+# costs one range query per window this way, while the sorted OID index the
+# module uses without read-ahead costs a lookup per row, which scans the
+# table when it has no encoded OID key. 0 switches to the index.
+sql_readahead = 50
+
+# Access statistics of the sql variation module, written every
+# sql_stats_interval seconds
+sql_stats_file = "/var/run/snmpsim/sql-stats.json"
+sql_stats_interval = 10
+
+# Milliseconds the SETs on the database served from memory are committed
+# together, see the group commit of the sql variation module
+memory_commit_interval = 100
+
 
 class SNMPSimService(object):
     def __init__(self):
@@ -36,6 +61,54 @@ class SNMPSimService(object):
             return True
         return False
 
+    def __mmap_data_dir(self, data_dir):
+        '''
+        Create a data file per community of data_dir which hands the whole
+        tree over to the mmapdb variation module.
+        '''
+        if not os.path.exists(mmap_data_dir):
+            os.makedirs(mmap_data_dir)
+
+        for data_file in glob.glob(os.path.join(data_dir, "*.snmprec")):
+            with open(os.path.join(mmap_data_dir,
+                                   os.path.basename(data_file)), "w") as fd:
+                fd.write("1.3.6|:mmapdb|" + os.linesep)
+        return mmap_data_dir
+
+    def __tenants_data_dir(self, data_dir):
+        '''
+        Create a data file per tenant community which hands the whole tree
+        over to the sql variation module with the table and database of the
+        tenant, next to the data files of data_dir. snmpsimd picks the data
+        file by the community of the request, so one snmpsimd serves all
+        tenants.
+        '''
+        if os.path.exists(tenants_data_dir):
+            shutil.rmtree(tenants_data_dir)
+        os.makedirs(tenants_data_dir)
+
+        for data_file in glob.glob(os.path.join(data_dir, "*.snmprec")):
+            shutil.copy(data_file, tenants_data_dir)
+
+        for community, (database, table) in \
+                self.__config_instance.tenants.items():
+            db_path = os.path.join(data_dir, database)
+            with open(os.path.join(tenants_data_dir,
+                                   community + ".snmprec"), "w") as fd:
+                fd.write("1.3.6|:sql|{0}@{1}".format(table, db_path) +
+                         os.linesep)
+        return tenants_data_dir
+
+    def __telemetry_option(self):
+        '''
+        Have the sql variation module compute the outlet power OIDs if there
+        is a load profile
+        '''
+        profile = self.__config_instance.telemetry_profile
+        if os.path.exists(profile):
+            return ",telemetry:" + profile
+        return ""
+
     def start(self):
         if not os.path.exists('/usr/bin/snmpsimd.py') \
                 and not os.path.exists('/bin/snmpsimd.py') \
@@ -54,6 +127,11 @@ class SNMPSimService(object):
 
         data_dir = self.__config_instance.snmp_data_dir
         db_path = os.path.join(data_dir, self.__config_instance.db_file)
+        if self.__db_type == "MMAP":
+            data_dir = self.__mmap_data_dir(data_dir)
+        elif self.__db_type in ("SQLITE", "MEMORY") and \
+                self.__config_instance.tenants:
+            data_dir = self.__tenants_data_dir(data_dir)
 
         args_list = ["snmpsimd.py"]
         endpoint_param = "--agent-udpv4-endpoint=0.0.0.0"
@@ -74,11 +152,38 @@ class SNMPSimService(object):
             variation_modules_dir = "--variation-modules-dir=" + \
                 self.__config_instance.variation_modules_dir
             args_list.append(variation_modules_dir)
-            sql_option = "--variation-module-options=sql:dbtype:sqlite3,database:" + db_path
+            sql_option = "--variation-module-options=" \
+                "sql:dbtype:sqlite3,database:" + db_path + \
+                ",readahead:" + str(sql_readahead) + \
+                ",statsfile:" + sql_stats_file + \
+                ",stats:" + str(sql_stats_interval) + \
+                ",channel:" + channel.channel_socket + \
+                self.__telemetry_option()
             args_list.append(sql_option)
+        elif self.__db_type == "MEMORY":
+            variation_modules_dir = "--variation-modules-dir=" + \
+                self.__config_instance.variation_modules_dir
+            args_list.append(variation_modules_dir)
+            memory_option = "--variation-module-options=" \
+                "sql:dbtype:memory,database:" + db_path + \
+                ",commitinterval:" + str(memory_commit_interval) + \
+                ",statsfile:" + sql_stats_file + \
+                ",stats:" + str(sql_stats_interval) + \
+                ",channel:" + channel.channel_socket + \
+                self.__telemetry_option()
+            args_list.append(memory_option)
         elif self.__db_type == "WRITECACHE":
-            writecache_option = "--variation-module-options=writecache:file:" + db_path
+            writecache_option = \
+                "--variation-module-options=writecache:file:" + db_path
             args_list.append(writecache_option)
+        elif self.__db_type == "MMAP":
+            variation_modules_dir = "--variation-modules-dir=" + \
+                self.__config_instance.variation_modules_dir
+            args_list.append(variation_modules_dir)
+            mmap_option = "--variation-module-options=mmapdb:file:" + \
+                oidmmap.map_path(db_path) + \
+                ",channel:" + channel.channel_socket
+            args_list.append(mmap_option)
         else:
             return -1
 
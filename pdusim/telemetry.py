@@ -0,0 +1,267 @@
+'''
+*********************************************************
+Copyright @ 2015 EMC Corporation All Rights Reserved
+*********************************************************
+
+Outlet power telemetry computed from the simulated outlet states.
+
+A PDUModel evaluates current, power and energy of all outlets of a PDU in
+one pass from the outlet states and a load profile. The result is kept for
+the resolution of the profile, so a walk over the outlet table evaluates
+the model once instead of once per OID. Energy is integrated over the time
+between evaluations.
+
+A Binding tells where the outlet states of a vendor are and which OID
+columns show which metric, see SENTRY3 below. Telemetry serves the bound
+OIDs for the variation modules.
+'''
+import math
+import time
+import ConfigParser
+
+
+class Profile(object):
+    '''
+    Load profile read from an INI file:
+
+        [pdu]
+        voltage = 208
+        powerfactor = 0.95
+        resolution = 1
+
+        [outlet]
+        load = 1.5
+        idle = 0
+        ripple = 0.1
+        period = 300
+
+        [outlet.3]
+        load = 4.2
+
+    load is the current in amps of an outlet which is on, idle that of an
+    outlet which is off. The current of an outlet which is on swings by
+    ripple times load over period seconds. [outlet] sets the defaults of all
+    outlets, [outlet.<n>] those of outlet n. resolution is the number of
+    seconds an evaluation of the model is served.
+    '''
+    defaults = {"voltage": 208.0,
+                "powerfactor": 0.95,
+                "resolution": 1.0,
+                "load": 1.5,
+                "idle": 0.0,
+                "ripple": 0.1,
+                "period": 300.0}
+
+    def __init__(self, profile_file=None):
+        self.__parser = ConfigParser.RawConfigParser()
+        if profile_file:
+            self.__parser.read(profile_file)
+        self.voltage = self.__get(["pdu"], "voltage")
+        self.power_factor = self.__get(["pdu"], "powerfactor")
+        self.resolution = self.__get(["pdu"], "resolution")
+        self.__outlets = {}
+
+    def __get(self, sections, option):
+        for section in sections:
+            if self.__parser.has_option(section, option):
+                return self.__parser.getfloat(section, option)
+        return self.defaults[option]
+
+    def outlet(self, outlet):
+        '''
+        Return (load, idle, ripple, period) of outlet
+        '''
+        if outlet not in self.__outlets:
+            sections = ["outlet.{0}".format(outlet), "outlet"]
+            self.__outlets[outlet] = tuple(
+                [self.__get(sections, option)
+                 for option in ("load", "idle", "ripple", "period")])
+        return self.__outlets[outlet]
+
+
+class Binding(object):
+    '''
+    states is the OID column of the outlet states, the outlet is the last
+    component of an OID below it. An outlet is on if its state is one of
+    on_states. outlets maps OID columns to (metric, convert), the value of
+    outlet n is convert(metric of outlet n) at <column>.<n>. totals maps
+    OIDs to (metric, convert) of the sum over all outlets.
+
+    The metrics are "on", "current" in amps, "power" in watts and "energy"
+    in watt hours.
+    '''
+
+    def __init__(self, name, states, on_states, outlets, totals=None):
+        self.name = name
+        self.states = states
+        self.on_states = set(on_states)
+        self.outlets = outlets
+        self.totals = totals or {}
+
+
+def hundredths(value):
+    return int(round(value * 100))
+
+
+def units(value):
+    return int(round(value))
+
+
+def tenth_kilowatt_hours(watt_hours):
+    return int(round(watt_hours / 100.0))
+
+
+# Sentry3-MIB, tower 1, infeed 1
+SENTRY3 = Binding(
+    "sentry3",
+    # outletControlState
+    "1.3.6.1.4.1.1718.3.2.3.1.10.1.1",
+    # idleOn, wakeOn, on, lockedOn, minimumOn, eventOn
+    ["1", "3", "5", "7", "13", "15"],
+    {
+        # outletStatus, off(0) or on(1)
+        "1.3.6.1.4.1.1718.3.2.3.1.5.1.1": ("on", lambda on: 1 if on else 0),
+        # outletLoadStatus, normal(0) or notOn(1)
+        "1.3.6.1.4.1.1718.3.2.3.1.6.1.1": ("on", lambda on: 0 if on else 1),
+        # outletLoadValue
+        "1.3.6.1.4.1.1718.3.2.3.1.7.1.1": ("current", hundredths),
+        # outletPower, in watts
+        "1.3.6.1.4.1.1718.3.2.3.1.15.1.1": ("power", units)
+    },
+    {
+        # infeedLoadValue
+        "1.3.6.1.4.1.1718.3.2.2.1.7.1.1": ("current", hundredths),
+        # infeedPower
+        "1.3.6.1.4.1.1718.3.2.2.1.12.1.1": ("power", units),
+        # infeedEnergy, in tenth kilowatt hours
+        "1.3.6.1.4.1.1718.3.2.2.1.16.1.1": ("energy", tenth_kilowatt_hours)
+    })
+
+BINDINGS = [SENTRY3]
+
+
+class PDUModel(object):
+    '''
+    Metrics of the outlets of one binding of one table
+    '''
+
+    def __init__(self, binding, profile):
+        self.binding = binding
+        self.profile = profile
+        self.evaluations = 0
+        self.__time = None
+        self.__index = {}
+        self.__metrics = {"on": [], "current": [], "power": [], "energy": []}
+        # outlet -> watt hours
+        self.__energy = {}
+
+    def __current(self, outlet, on, now):
+        load, idle, ripple, period = self.profile.outlet(outlet)
+        if not on:
+            return idle
+        # Outlets do not swing in step
+        phase = outlet * 0.618
+        return load * (1 + ripple * math.sin(2 * math.pi *
+                                             (now / period + phase)))
+
+    def evaluate(self, read_states, now=None):
+        '''
+        Compute the metrics of all outlets unless the last evaluation is
+        younger than the resolution of the profile. read_states(column)
+        returns (oid, state) of the outlets.
+        '''
+        if now is None:
+            now = time.time()
+        if self.__time is not None and \
+                now - self.__time < self.profile.resolution:
+            return
+
+        # The power of the last evaluation was drawn since then
+        if self.__time is not None:
+            hours = (now - self.__time) / 3600
+            for outlet, i in self.__index.items():
+                self.__energy[outlet] += self.__metrics["power"][i] * hours
+
+        outlets = []
+        on = []
+        for oid, state in read_states(self.binding.states):
+            outlets.append(int(oid.rpartition(".")[2]))
+            on.append(state in self.binding.on_states)
+
+        watts = self.profile.voltage * self.profile.power_factor
+        current = [self.__current(outlet, outlet_on, now)
+                   for outlet, outlet_on in zip(outlets, on)]
+        for outlet in outlets:
+            self.__energy.setdefault(outlet, 0.0)
+        self.__metrics = {
+            "on": on,
+            "current": current,
+            "power": [amps * watts for amps in current],
+            "energy": [self.__energy[outlet] for outlet in outlets]
+        }
+        self.__index = dict([(outlet, i) for i, outlet in enumerate(outlets)])
+        self.__time = now
+        self.evaluations += 1
+
+    def outlet(self, metric, outlet):
+        '''
+        Return metric of outlet, None if there is no such outlet
+        '''
+        i = self.__index.get(outlet)
+        if i is None:
+            return None
+        return self.__metrics[metric][i]
+
+    def total(self, metric):
+        return sum(self.__metrics[metric])
+
+
+class Telemetry(object):
+    '''
+    Serve the OIDs of the bindings, with a model per binding and table
+    '''
+
+    def __init__(self, profile, bindings=None):
+        self.profile = profile
+        # OID column -> (binding, metric, convert)
+        self.__outlets = {}
+        # OID -> (binding, metric, convert)
+        self.__totals = {}
+        # (table, binding name) -> PDUModel
+        self.__models = {}
+        for binding in bindings or BINDINGS:
+            for column, (metric, convert) in binding.outlets.items():
+                self.__outlets[column] = (binding, metric, convert)
+            for oid, (metric, convert) in binding.totals.items():
+                self.__totals[oid] = (binding, metric, convert)
+
+    def model(self, table, binding):
+        key = (table, binding.name)
+        if key not in self.__models:
+            self.__models[key] = PDUModel(binding, self.profile)
+        return self.__models[key]
+
+    def value(self, oid, table, read_states):
+        '''
+        Return the value of oid computed by the model of table, None if no
+        binding covers oid. read_states is passed to PDUModel.evaluate().
+        '''
+        oid = str(oid)
+        column, _, outlet = oid.rpartition(".")
+        entry = self.__outlets.get(column)
+        if entry is not None:
+            binding, metric, convert = entry
+            model = self.model(table, binding)
+            model.evaluate(read_states)
+            value = model.outlet(metric, int(outlet))
+            if value is None:
+                return None
+            return str(convert(value))
+
+        entry = self.__totals.get(oid)
+        if entry is not None:
+            binding, metric, convert = entry
+            model = self.model(table, binding)
+            model.evaluate(read_states)
+            return str(convert(model.total(metric)))
+        return None
@@ -7,6 +7,7 @@ import time
 import basepdu
 import threading
 import password as pwd
+import snmprecdb
 import common.logger as logger
 
 
@@ -37,17 +38,30 @@ class vHawk(basepdu.vPDUBase):
         '''
         Put all outlets into 'error' mode when vpdu starts
         '''
-        for outlet_index in range(self.max_outlets):
-            on_offset = self.pduouton_oid_offset + "." + \
-                str(self.to_oid_pdu(self.pdu))
-            self.set_outlet_mode(on_offset, outlet_index + 1, "error")
+        on_offset = self.pduouton_oid_offset + "." + \
+            str(self.to_oid_pdu(self.pdu))
+        outlets = self.get_outlets_field(on_offset).keys()
+        self.set_outlets_mode(on_offset, outlets, "error")
 
     def __init_outlets_password(self):
-        for outlet_index in range(self.max_outlets):
-            pwd_offset = self.pduoutpwd_oid_offset + "." + \
-                str(self.to_oid_pdu(self.pdu))
-            self.set_outlet_field(pwd_offset, outlet_index + 1,
-                                  self.default_password)
+        pwd_offset = self.pduoutpwd_oid_offset + "." + \
+            str(self.to_oid_pdu(self.pdu))
+        self.set_outlets_field(pwd_offset, range(1, self.max_outlets + 1),
+                               self.default_password)
+
+    def outlets_status(self):
+        '''
+        Return a dict outlet -> action last set for the outlet
+        '''
+        on_offset = self.pduouton_oid_offset + "." + \
+            str(self.to_oid_pdu(self.pdu))
+        status = {}
+        for outlet, value in self.get_outlets_field(on_offset).items():
+            try:
+                status[outlet] = self.actions[self.extract(value)]
+            except (ValueError, IndexError):
+                status[outlet] = 'unknown'
+        return status
 
     def to_oid_pdu(self, index):
         '''
@@ -58,17 +72,10 @@ class vHawk(basepdu.vPDUBase):
 
     def extract(self, value_pattern):
         '''
-        value_pattern could be just an integer, or something like:
-        mode=normal,value=2
+        value_pattern is just an integer, or something like
+        mode=normal,value=2 if the database keeps the mode in the value.
         '''
-        try:
-            value_settings = {}
-            value_settings = \
-                dict([self.split(x, '=') for x in self.split(value_pattern, ',')])
-            if 'value' in value_settings:
-                return int(value_settings['value'])
-        except:
-            return int(value_pattern)
+        return int(snmprecdb.split_mode(value_pattern)[1])
 
     def handle_outlet(self, args):
         outlet = args[0]
@@ -198,25 +205,18 @@ class vHawk(basepdu.vPDUBase):
         t.start()
         logger.info("Timer for {0}/{1} started.".format(outlet, self.pdu))
 
-    def handle_message(self, message):
-        oid = message.split()[0]
-        outlet = oid.split('.')[-1]
-        value = message.split()[1]
-        logger.info("Handle message {0}".format(message))
-        if message.startswith(self.pduouton_oid_offset):
-            self.add_task("handle_outlet-{0}".
-                          format(outlet), self.handle_outlet,
-                          int(outlet), value)
-        elif message.startswith(self.pduoutpwd_oid_offset):
-            self.add_task("handle_password-{0}".
-                          format(outlet), self.handle_password,
-                          int(outlet), value)
-        else:
-            logger.warn("{0} is not handled now.".format(message))
+    def register_columns(self, router):
+        pdu_id = str(self.to_oid_pdu(self.pdu))
+        router.register(self.pduouton_oid_offset + "." + pdu_id, self,
+                        self.handle_outlet)
+        router.register(self.pduoutpwd_oid_offset + "." + pdu_id, self,
+                        self.handle_password)
 
     def setup(self):
         self.__init_outlets()
         self.__init_outlets_password()
+        logger.info("Outlets of PDU {0}: {1}".
+                    format(self.pdu, self.outlets_status()))
 
     def teardown(self):
         pass
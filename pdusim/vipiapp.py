@@ -7,7 +7,9 @@ import sys
 import select
 import threading
 import vhawk
+import oidrouter
 import common.logger as logger
+import common.pipe as pipe
 
 
 class vIPIAppliance(object):
@@ -19,6 +21,7 @@ class vIPIAppliance(object):
         self.__node_control_handler = node_control_handler
         self.pdu_num = 6
         self.__pdus = []
+        self.__router = oidrouter.OIDRouter()
         self.__create()
 
     def __create(self):
@@ -28,44 +31,40 @@ class vIPIAppliance(object):
                                    self.__node_control_handler)
             vhawkpdu.pdu = pdu + 1
             vhawkpdu.setup()
+            vhawkpdu.register_columns(self.__router)
             self.__pdus.append(vhawkpdu)
 
-    def to_index(self, pdu_id):
+    def dispatch(self, message):
         '''
-        pdu_id is used in OID which defined by vendor, it shoud be:
-        1, 4, 7, 10, 13, 16
-        index should be: 0, 1, 2, 3, 4, 5, 6
+        Hand the varbinds of a message to their PDUs, each PDU gets its
+        varbinds as one plan
         '''
-        if isinstance(pdu_id, int):
-            return pdu_id / 3 + pdu_id % 3 - 1
-        raise ValueError("pdu_id should be integer.")
+        varbinds = pipe.varbinds(message)
+        for oid, _ in varbinds:
+            # The OID was written by snmpset, drop cached values
+            self.__oid_handler.invalidate(oid)
+        self.__router.dispatch(varbinds)
 
     def main_loop(self):
-        rlist = []
-        rlist.append(self.__pipe.inform)
         timeout = 10
         print "Total threads: {0}".format(threading.activeCount())
         try:
             while self.__running:
-                readable, _, _ = select.select(rlist, [], [], timeout)
+                # Channel connections come and go, select them anew
+                readable, _, _ = select.select(self.__pipe.fds(), [], [],
+                                               timeout)
                 if not readable:
                     continue
 
-                if self.__pipe.inform in readable:
-                    try:
-                        message = self.__pipe.read(256)
-                    except OSError, exc:
-                        logger.warn("[Error %d] appeared at reading pipe" %
-                                    exc.errno)
-                        continue
-
-                    if len(message) == 0:
-                        continue
+                try:
+                    messages = self.__pipe.read_messages()
+                except OSError, exc:
+                    logger.warn("[Error %d] appeared at reading pipe" %
+                                exc.errno)
+                    continue
 
-                    pdu_id = message.split()[0].split('.')[-2]
-                    pdu_index = self.to_index(int(pdu_id))
-                    logger.info("Assign message to pdu {0}".format(pdu_id))
-                    self.__pdus[pdu_index].handle_message(message)
+                for message in messages:
+                    self.dispatch(message)
         except KeyboardInterrupt:
             logger.error("Break by user.")
         except Exception, ex:
@@ -73,6 +72,7 @@ class vIPIAppliance(object):
         finally:
             logger.info("vIPI Appliance service exits.")
             self.__pipe.close()
+            self.__oid_handler.close()
 
     def stop(self):
         self.__running = False
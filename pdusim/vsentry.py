@@ -6,6 +6,7 @@ Copyright @ 2015 EMC Corporation All Rights Reserved
 import select
 import sys
 import common.logger as logger
+import common.pipe as pipe
 import basepdu
 
 
@@ -56,6 +57,19 @@ class vSentry(basepdu.vPDUBase):
     def __init_outlets_state(self):
         pass
 
+    def outlets_status(self):
+        '''
+        Return a dict outlet -> state of the outlet
+        '''
+        status = {}
+        for outlet, value in \
+                self.get_outlets_field(self.outlet_state_oid_offset).items():
+            try:
+                status[outlet] = self.states[int(value)]
+            except (ValueError, IndexError):
+                status[outlet] = 'unknown'
+        return status
+
     def handle_outlet(self, args):
         '''
         1. Get current outlet state
@@ -114,39 +128,34 @@ class vSentry(basepdu.vPDUBase):
             return
         self.set_outlet_field(self.outlet_action_oid_offset, outlet, 0)
 
-    def handle_message(self, message):
-        logger.info("Got new message {0}".format(message))
-        oid = message.split()[0]
-        outlet = oid.split('.')[-1]
-        value = message.split()[1]
-        if oid.startswith(self.outlet_action_oid_offset):
-            self.add_task("handle outlet {0}".format(outlet),
-                          self.handle_outlet, int(outlet), value)
-        else:
-            logger.warn("{0} is not handled now.".format(message))
+    def register_columns(self, router):
+        router.register(self.outlet_action_oid_offset, self,
+                        self.handle_outlet)
 
     def main_loop(self):
-        rlist = []
-        rlist.append(self.__pipe.inform)
         timeout = 10
         try:
+            logger.info("Outlets: {0}".format(self.outlets_status()))
             while self.__running:
-                readable, _, _ = select.select(rlist, [], [], timeout)
+                # Channel connections come and go, select them anew
+                readable, _, _ = select.select(self.__pipe.fds(), [], [],
+                                               timeout)
                 if not readable:
                     continue
 
-                if self.__pipe.inform in readable:
-                    try:
-                        message = self.__pipe.read(256)
-                    except OSError, exc:
-                        logger.warn("[Error %d] appeared at reading pipe" %
-                                    exc.errno)
-                        continue
-
-                    if len(message) == 0:
-                        continue
+                try:
+                    messages = self.__pipe.read_messages()
+                except OSError, exc:
+                    logger.warn("[Error %d] appeared at reading pipe" %
+                                exc.errno)
+                    continue
 
-                    self.handle_message(message)
+                for message in messages:
+                    varbinds = pipe.varbinds(message)
+                    # The OIDs were written by snmpset, drop cached values
+                    for oid, _ in varbinds:
+                        self.oid_handler.invalidate(oid)
+                    self.router.dispatch(varbinds)
         except KeyboardInterrupt:
             logger.error("Break by user.")
         except Exception, ex:
@@ -154,6 +163,7 @@ class vSentry(basepdu.vPDUBase):
         finally:
             logger.info("vSentry service exits.")
             self.__pipe.close()
+            self.oid_handler.close()
 
     def stop(self):
         self.__running = False
@@ -0,0 +1,157 @@
+'''
+*********************************************************
+Copyright @ 2015 EMC Corporation All Rights Reserved
+*********************************************************
+
+Pool of worker threads shared by the tasks of all PDUs.
+
+Every task is submitted with a key. Tasks with the same key run one after
+the other in the order they were submitted, tasks with different keys run
+concurrently on up to size threads. The PDUs key the tasks of an outlet with
+(pdu, outlet), so a slow power operation on one outlet does not hold up the
+other outlets, and idle PDUs hold no threads.
+
+A task may be submitted with a coalesce tag. It replaces the last task of
+its key if that one has the same tag and did not start yet, so when an
+outlet is flapped faster than the hypervisor follows only the last of the
+queued actions is run.
+'''
+import time
+import Queue
+import threading
+import collections
+import common.logger as logger
+from common.colors import bcolors as colors
+
+DEFAULT_SIZE = 8
+
+# Queued to make a worker exit
+_STOP = object()
+
+
+class WorkerPool(object):
+
+    def __init__(self, size=DEFAULT_SIZE):
+        self.size = size
+        self.__lock = threading.Lock()
+        # key -> deque of [task name, func, args, submit time, coalesce
+        # tag], the first task of a key is running or its key is in the
+        # ready queue
+        self.__pending = {}
+        # Keys whose first task is running
+        self.__running = set()
+        self.__collapsed = 0
+        self.__ready = Queue.Queue()
+        self.__tasks = 0
+        self.__wait_total = 0.0
+        self.__wait_max = 0.0
+        self.__threads = []
+        for i in range(size):
+            thread = threading.Thread(target=self.__run,
+                                      name="vpdu-worker-{0}".format(i))
+            thread.setDaemon(True)
+            thread.start()
+            self.__threads.append(thread)
+
+    def submit(self, key, task_name, func, args, coalesce=None):
+        '''
+        Queue func(args) behind the tasks of key which did not finish yet,
+        or in place of the last of them if it is tagged coalesce as well
+        and has not started
+        '''
+        task = [task_name, func, args, time.time(), coalesce]
+        with self.__lock:
+            tasks = self.__pending.get(key)
+            if tasks is not None:
+                last = tasks[-1]
+                if coalesce is not None and last[4] == coalesce and \
+                        (len(tasks) > 1 or key not in self.__running):
+                    logger.info("Task {0} replaces {1}".
+                                format(task_name, last[0]))
+                    # Keep the place and the wait of the replaced task
+                    last[0:3] = task[0:3]
+                    self.__collapsed += 1
+                    return
+                tasks.append(task)
+                return
+            self.__pending[key] = collections.deque([task])
+        self.__ready.put(key)
+
+    def __run(self):
+        while True:
+            key = self.__ready.get()
+            if key is _STOP:
+                return
+
+            with self.__lock:
+                task_name, func, args, submitted, _ = self.__pending[key][0]
+                self.__running.add(key)
+                waited = time.time() - submitted
+                self.__tasks += 1
+                self.__wait_total += waited
+                self.__wait_max = max(self.__wait_max, waited)
+
+            logger.info("Running task ... {peachblow}{task_name}{normal} "
+                        "on thread {threadname} after {waited:.1f} ms".
+                        format(peachblow=colors.PEACHBLOW,
+                               task_name=task_name,
+                               normal=colors.NORMAL,
+                               threadname=threading.currentThread().getName(),
+                               waited=waited * 1000))
+            try:
+                func(args)
+                logger.info("{cyan}{task_name}{normal} Done".
+                            format(cyan=colors.CYAN,
+                                   task_name=task_name,
+                                   normal=colors.NORMAL))
+            except Exception, ex:
+                logger.error("{0}: {1}".format(task_name, ex))
+
+            with self.__lock:
+                self.__running.discard(key)
+                tasks = self.__pending[key]
+                tasks.popleft()
+                if not tasks:
+                    del self.__pending[key]
+            if tasks:
+                self.__ready.put(key)
+
+    def stats(self):
+        '''
+        Return the number of tasks run, queued and replaced by a later task
+        and their queue wait in milliseconds
+        '''
+        with self.__lock:
+            queued = sum([len(tasks) for tasks in self.__pending.values()])
+            return {"tasks": self.__tasks,
+                    "queued": queued,
+                    "collapsed": self.__collapsed,
+                    "wait_avg": self.__wait_total * 1000 /
+                    max(self.__tasks, 1),
+                    "wait_max": self.__wait_max * 1000}
+
+    def close(self):
+        '''
+        Let the workers exit, tasks queued behind the stop are not run
+        '''
+        for _ in self.__threads:
+            self.__ready.put(_STOP)
+
+
+_pool = None
+
+
+def set_pool(pool):
+    global _pool
+    _pool = pool
+
+
+def get_pool():
+    '''
+    Return the pool of this process, one of the default size unless
+    set_pool() was called
+    '''
+    global _pool
+    if _pool is None:
+        _pool = WorkerPool()
+    return _pool
@@ -50,6 +50,7 @@ setup(
             "Programming Language :: Python :: 2.6",
             "Programming Language :: Python :: 2.7",
         ],
-        scripts = ["infrasim-pdusimd.py", "infrasim-pduserv.py"],
+        scripts = ["infrasim-pdusimd.py", "infrasim-pduserv.py",
+                   "infrasim-pdudb.py"],
         data_files = data_files,
 )
@@ -0,0 +1,133 @@
+#
+# SNMP Simulator, http://snmpsim.sourceforge.net
+#
+# Managed value variation module: simulate a writable Agent serving Managed
+# Objects from a compiled, memory-mapped OID table (see pdusim/oidmmap.py)
+#
+# Module initialization parameters are file:<compiled table> and optionally
+# channel:<socket> to send informs over the Unix socket channel of the vPDU,
+# informqueue:<oids> and informretry:<seconds> to size the queue of informs
+# the vPDU did not take and the interval they are retried at (see sql.py)
+#
+# Exact GETs and GETNEXT are binary searches over the mapped file, which is
+# shared with every other process serving the same table. SETs go to the
+# table's SQLite overlay.
+#
+from snmpsim.grammar.snmprec import SnmprecGrammar
+from snmpsim.mltsplit import split
+from snmpsim import error, log
+from pysnmp.smi import error as Error
+from pdusim import oidmmap
+from pdusim import snmprecdb
+from pdusim.common import pipe
+from pdusim.common import channel
+
+moduleContext = {}
+
+
+def init(**context):
+    options = {}
+    if context['options']:
+        options.update(
+            dict([split(x, ':') for x in split(context['options'], ',')])
+        )
+    if 'file' not in options:
+        raise error.SnmpsimError('compiled OID table not specified')
+
+    try:
+        moduleContext['table'] = oidmmap.OIDTable(options['file'])
+    except Exception, ex:
+        raise error.SnmpsimError('---> Infrasim: {0}: {1}'.
+                                 format(Exception, ex))
+
+    # The mapped table has no caches to keep coherent
+    moduleContext['channel'] = None
+    if 'channel' in options:
+        moduleContext['channel'] = channel.Client(lambda kind, body: None,
+                                                  log.msg, options['channel'])
+
+    try:
+        moduleContext['inform'] = pipe.Informer(
+            channel=moduleContext['channel'],
+            max_queued=int(options.get('informqueue', pipe.MAX_QUEUED)),
+            retry_interval=float(options.get('informretry',
+                                             pipe.RETRY_INTERVAL)))
+    except Exception, ex:
+        raise error.SnmpsimError('---> Infrasim: {0}: {1}'.
+                                 format(Exception, ex))
+
+
+def variate(oid, tag, value, **context):
+    if 'table' in moduleContext:
+        table = moduleContext['table']
+    else:
+        raise error.SnmpsimError('variation module not initialized')
+
+    origOid = context['origOid']
+    idx = max(0, context['varsTotal'] - context['varsRemaining'] - 1)
+    if context['setFlag']:
+        if 'hexvalue' in context:
+            textTag = context['hextag']
+            textValue = context['hexvalue']
+        else:
+            textTag = SnmprecGrammar().getTagByType(context['origValue'])
+            textValue = str(context['origValue'])
+
+        record = table.get(origOid)
+        if record is None:
+            raise Error.NoSuchInstanceError(name=origOid, idx=idx)
+
+        _, recordValue, writable = record
+        if not writable:
+            return origOid, tag, context['errorStatus']
+
+        value_written = textValue
+        mode, _ = snmprecdb.split_mode(recordValue)
+        # if detected error mode, raise an error
+        if mode == 'error':
+            raise Error.WrongValueError(name=origOid, idx=idx)
+        elif mode == 'normal':
+            value_written = snmprecdb.join_mode(mode, textValue)
+        elif mode is not None:
+            return origOid, tag, context['errorStatus']
+
+        table.set(str(origOid), value_written, textTag)
+
+        # Queued and retried if the vPDU does not take it now
+        moduleContext['inform'].add(
+            origOid, textValue,
+            first=context['varsRemaining'] == context['varsTotal'] - 1,
+            last=context['varsRemaining'] == 0)
+
+        return origOid, textTag, context['origValue']
+    else:
+        if context['nextFlag']:
+            record = table.get_next(origOid)
+            if record is None:
+                return origOid, tag, context['errorStatus']
+            origOid = origOid.clone(record[0])
+            record = record[1:]
+        else:
+            record = table.get(origOid)
+            if record is None:
+                return origOid, tag, context['errorStatus']
+
+        recordTag, recordValue, _ = record
+        return origOid, recordTag, snmprecdb.split_mode(recordValue)[1]
+
+
+def shutdown(**context):
+    table = moduleContext.get('table')
+    if table:
+        table.close()
+
+    inform = moduleContext.get('inform')
+    if inform:
+        inform.close()
+        log.msg('mmapdb: informs %(sent)d sent, %(retries)d retries, '
+                '%(coalesced)d coalesced, %(dropped)d dropped, '
+                '%(resent)d resent, %(queued)d not delivered, '
+                '%(unacked)d not acknowledged' % inform.counters())
+
+    if moduleContext.get('channel'):
+        moduleContext['channel'].close()
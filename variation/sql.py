@@ -5,15 +5,92 @@
 # SQL backend for storing Managed Objects
 #
 # Module initialization parameters are dbtype:<dbms>,dboptions:<options>
+# and optionally
+#   indexrefresh:<seconds>  interval to check the OIDs of a table for added
+#                           or removed rows
+#   readahead:<rows>        rows fetched at once by GETNEXT, the following
+#                           successors of a GETBULK are served from them,
+#                           0 (default) disables read-ahead and finds the
+#                           successor in a sorted index of the OIDs
+#   readaheadage:<seconds>  time read-ahead rows are served, as they do not
+#                           see writes of other processes
+#   commitinterval:<ms>     group commit, SET PDUs are committed together at
+#                           most <ms> after the first of them
+#   commitpdus:<pdus>       group commit, commit once <pdus> SET PDUs are
+#                           pending, or commitinterval (default 100 ms)
+#                           after the first of them
+# Without group commit every SET PDU is committed on its own. Pending
+# writes are visible to this module right away, to other processes, such
+# as the vPDU, only after the group commit. The open write transaction
+# locks SQLite databases for other writers until then. The informs of the
+# SETs are sent once they are committed, so the vPDU reads what was set.
+# A SET PDU failing on a varbind counts as done with the varbinds set
+# before, as without this module they would have been written already.
+#
+# The value of a record names the table, <table>@<database> serves the
+# table of another database with the same connect parameters. This routes
+# the communities of several tenants, each with a .snmprec file of its own,
+# to their databases within one snmpsimd. Databases are connected on the
+# first request for them and the connections are kept open, the routing of
+# a record is resolved once. SETs on a table of another database send no
+# informs, the vPDU only drives the PDU of the configured database.
 #
 # Expects to work a table of the following layout:
 # CREATE TABLE <tablename> (oid text, tag text, value text, maxaccess text)
 #
+# SQLite tables upgraded by pdusim.snmprecdb carry an additional indexed
+# 'okey' column with the byte-sortable encoded OID, which is then used for
+# all lookups instead of the padded text OID, and a 'mode' column holding
+# the outlet mode which legacy tables fold into the value as
+# 'mode=<mode>,value=<value>'.
+#
+# GETNEXT resolves the successor OID with bisect in a sorted in-memory
+# index of the table keys, which is loaded on first use. Changed row counts
+# and rows which have gone missing reload the index.
+#
+# dbtype:memory loads the tables of a SQLite database into memory (see
+# pdusim/memtable.py) and serves all requests from there. SETs are written
+# back when they are committed, on their own or by group commit, what
+# other processes commit to the database is reloaded on the next request.
+#
+# statsfile:<path> counts GET, GETNEXT and SET calls and their latency per
+# OID prefix (see pdusim/oidstats.py) and writes them to <path> every
+# stats:<seconds> (default 10) and at shutdown. The prefix is the OID
+# without its instance component, or its first statsprefix:<components>.
+#
+# channel:<socket> connects to the Unix socket channel of the vPDU (see
+# pdusim/common/channel.py). Informs go over it while it is connected,
+# and the notifications of the vPDU about OIDs it changed drop the
+# read-ahead rows and reload tables held in memory, which then are not
+# checked for changes on every request.
+#
+# Informs the vPDU does not take, as it is slow or restarting, are queued
+# and retried every informretry:<seconds> (default 1) without holding up
+# SETs. The queue keeps the last value of at most informqueue:<oids>
+# (default 1000) OIDs and drops the oldest beyond that. Informs sent over
+# the channel which the vPDU did not acknowledge before the connection
+# broke are queued again. The queue depth and the counters are logged at
+# shutdown and written to the statsfile.
+#
+# telemetry:<profile> computes outlet current, power and energy OIDs from
+# the outlet states of the table and the load profile in the <profile> INI
+# file (see pdusim/telemetry.py) when they are read, instead of serving
+# the stored values.
+#
 from snmpsim.grammar.snmprec import SnmprecGrammar
 from snmpsim.mltsplit import split
 from snmpsim import error, log
 from pysnmp.smi import error as Error
-import os
+from pdusim.common import oidkey
+from pdusim import snmprecdb
+from pdusim import memtable
+from pdusim import oidstats
+from pdusim import telemetry
+from pdusim.common import pipe
+from pdusim.common import channel
+import time
+import bisect
+import threading
 
 isolationLevels = {
     '0': 'READ UNCOMMITTED',
@@ -22,6 +99,16 @@ isolationLevels = {
     '3': 'SERIALIZABLE'
 }
 
+# Seconds a group commit waits at most when only commitpdus is given
+defaultCommitInterval = 0.1
+
+# Statement placeholder by DB-API paramstyle
+placeholders = {
+    'qmark': '?',
+    'format': '%s',
+    'pyformat': '%s'
+}
+
 
 moduleContext = {}
 
@@ -34,6 +121,9 @@ def init(**context):
         )
     if 'dbtype' not in options:
         raise error.SnmpsimError('database type not specified')
+    moduleContext['memory'] = memory = options['dbtype'] == 'memory'
+    if memory:
+        options['dbtype'] = 'sqlite3'
     db = __import__(
         options['dbtype'],
         globals(), locals(),
@@ -55,49 +145,462 @@ def init(**context):
                 connectParams[k] = int(connectParams[k])
     if not connectParams:
         raise error.SnmpsimError('database connect parameters not specified')
-    moduleContext['dbConn'] = dbConn = db.connect(**connectParams)
-    moduleContext['dbTable'] = dbTable = options.get('dbtable', 'snmprec')
+
+    moduleContext['commitInterval'] = \
+        float(options.get('commitinterval', 0)) / 1000
+    moduleContext['commitPdus'] = int(options.get('commitpdus', 0))
+    moduleContext['groupCommit'] = groupCommit = \
+        moduleContext['commitInterval'] > 0 or moduleContext['commitPdus'] > 1
+    if groupCommit and not moduleContext['commitInterval']:
+        # Never keep the write transaction open waiting for more PDUs
+        moduleContext['commitInterval'] = defaultCommitInterval
+    if (groupCommit or memory) and options['dbtype'] == 'sqlite3':
+        # Group commits and the refreshes of the channel client run on
+        # their own threads
+        connectParams['check_same_thread'] = False
+    moduleContext['lock'] = threading.RLock()
+    moduleContext['flusher'] = None
+    moduleContext['pendingPdus'] = 0
+    moduleContext['commits'] = 0
+    moduleContext['savedCommits'] = 0
+    moduleContext['memoryTables'] = {}
+    moduleContext['statsFile'] = options.get('statsfile')
+    moduleContext['statsInterval'] = float(options.get('stats', 10))
+    moduleContext['stats'] = None
+    moduleContext['statsWriter'] = None
+    if moduleContext['statsFile']:
+        moduleContext['stats'] = oidstats.OIDStats(
+            int(options.get('statsprefix', 0)))
+    moduleContext['telemetry'] = None
+    if 'telemetry' in options:
+        moduleContext['telemetry'] = telemetry.Telemetry(
+            telemetry.Profile(options['telemetry']))
+
+    moduleContext['connectParams'] = connectParams
+    moduleContext['dbType'] = options['dbtype']
+    moduleContext['dbTable'] = options.get('dbtable', 'snmprec')
     moduleContext['isolationLevel'] = options.get('isolationlevel', '1')
     if moduleContext['isolationLevel'] not in isolationLevels:
         raise error.SnmpsimError('unknown SQL transaction isolation level %s' %
                                  moduleContext['isolationLevel'])
 
-    if not os.path.exists("/tmp/inform"):
-        os.mkfifo('/tmp/inform')
+    # Everything depending on the DBMS is settled here once, variate() only
+    # runs the prepared statements of a table on the cursor of its database.
+    moduleContext['dbModule'] = db
+    moduleContext['placeholder'] = placeholders.get(
+        getattr(db, 'paramstyle', 'qmark'), '?')
+    moduleContext['indexRefresh'] = float(options.get('indexrefresh', 5))
+    moduleContext['readAhead'] = int(options.get('readahead', 0))
+    moduleContext['readAheadAge'] = float(options.get('readaheadage', 1))
+    moduleContext['tables'] = {}
+    moduleContext['databases'] = {}
+    moduleContext['pendingConns'] = set()
+    database = openDatabase(None)
+    moduleContext['dbConn'] = database['conn']
+    moduleContext['cursor'] = database['cursor']
+
+    if memory:
+        getTable(moduleContext['dbTable'])
+
+    if moduleContext['stats']:
+        stop = threading.Event()
+        statsWriter = threading.Thread(target=statsLoop, args=(stop,),
+                                       name='sql-stats')
+        statsWriter.setDaemon(True)
+        statsWriter.start()
+        moduleContext['statsWriter'] = (statsWriter, stop)
+
+    moduleContext['channel'] = None
+    if 'channel' in options:
+        moduleContext['channel'] = channel.Client(notified, log.msg,
+                                                  options['channel'])
 
     try:
-        moduleContext['inform'] = inform = os.open("/tmp/inform",
-                                                   os.O_WRONLY | os.O_NONBLOCK)
+        moduleContext['inform'] = pipe.Informer(
+            channel=moduleContext['channel'],
+            max_queued=int(options.get('informqueue', pipe.MAX_QUEUED)),
+            retry_interval=float(options.get('informretry',
+                                             pipe.RETRY_INTERVAL)))
     except Exception, ex:
-        raise error.SnmpsimError('---> Infrasim: {0}: {1}'.format(Exception, ex))
+        raise error.SnmpsimError('---> Infrasim: {0}: {1}'.
+                                 format(Exception, ex))
 
 
-def variate(oid, tag, value, **context):
-    if 'dbConn' in moduleContext:
-        dbConn = moduleContext['dbConn']
+def openDatabase(name):
+    """
+    Return the connection and cursor of database name, the configured one
+    for None. Connections are opened on first use and kept open.
+    """
+    databases = moduleContext['databases']
+    if name not in databases:
+        connectParams = dict(moduleContext['connectParams'])
+        if name is not None:
+            # MySQLdb names the database 'db'
+            if 'db' in connectParams:
+                connectParams['db'] = name
+            else:
+                connectParams['database'] = name
+        dbConn = moduleContext['dbModule'].connect(**connectParams)
+        cursor = dbConn.cursor()
+        if moduleContext['dbType'] != 'sqlite3':
+            try:
+                cursor.execute(
+                    'set session transaction isolation level %s' %
+                    isolationLevels[moduleContext['isolationLevel']]
+                )
+                cursor.fetchall()
+            except Exception:
+                log.msg('transaction isolation level not supported by %s' %
+                        moduleContext['dbType'])
+        databases[name] = {'conn': dbConn, 'cursor': cursor}
+    return databases[name]
+
+
+def prepareTable(dbTable, database=None):
+    """Build the statements for dbTable according to its layout"""
+    db = openDatabase(database)
+    dbConn = db['conn']
+    isSqlite = moduleContext['dbType'] == 'sqlite3'
+    table = {'name': dbTable,
+             'source': (database, dbTable),
+             # Tenant tables are not wired to the vPDU
+             'inform': database is None,
+             'conn': dbConn,
+             'cursor': db['cursor'],
+             'structured': isSqlite and snmprecdb.has_mode(dbConn, dbTable)}
+    # Keys are kept as str, sorting the same in Python and in the database
+    if isSqlite and snmprecdb.has_oid_key(dbConn, dbTable):
+        column = snmprecdb.OID_KEY_COLUMN
+        table['toKey'] = oidkey.encode
+        table['fromKey'] = oidkey.decode
+        table['keyParam'] = moduleContext['dbModule'].Binary
+        table['subtreeEnd'] = oidkey.subtree_end
     else:
-        raise error.SnmpsimError('variation module not initialized')
+        column = 'oid'
+        table['toKey'] = oidkey.to_sql_oid
+        table['fromKey'] = oidkey.from_sql_oid
+        table['keyParam'] = str
+        # '/' follows '.' in ASCII
+        table['subtreeEnd'] = lambda key: key + '/'
+
+    params = {'table': dbTable, 'column': column,
+              'p': moduleContext['placeholder'],
+              'readAhead': moduleContext['readAhead'],
+              'mode': table['structured'] and ',mode' or ''}
+    table['selectForSet'] = \
+        'select maxaccess,tag,value%(mode)s from %(table)s ' \
+        'where %(column)s=%(p)s limit 1' % params
+    table['update'] = \
+        'update %(table)s set tag=%(p)s,value=%(p)s ' \
+        'where %(column)s=%(p)s' % params
+    table['select'] = \
+        'select tag,value from %(table)s where %(column)s=%(p)s limit 1' % \
+        params
+    table['selectNext'] = \
+        'select %(column)s,tag,value from %(table)s where %(column)s>%(p)s ' \
+        'order by %(column)s limit 1' % params
+    table['selectWindow'] = \
+        'select %(column)s,tag,value from %(table)s where %(column)s>%(p)s ' \
+        'order by %(column)s limit %(readAhead)d' % params
+    table['selectSubtree'] = \
+        'select %(column)s,value from %(table)s where %(column)s>%(p)s ' \
+        'and %(column)s<%(p)s order by %(column)s' % params
+    table['selectKeys'] = 'select %(column)s from %(table)s' % params
+    table['countKeys'] = 'select count(*) from %(table)s' % params
+    table['index'] = None
+    table['window'] = None
+    if moduleContext['memory']:
+        memoryTables = moduleContext['memoryTables']
+        if table['source'] not in memoryTables:
+            memoryTables[table['source']] = \
+                memtable.MemoryTable(dbConn, dbTable)
+        table['memory'] = memoryTables[table['source']]
+    return table
+
+
+def keyParam(table, oid):
+    return table['keyParam'](table['toKey'](oid))
+
+
+def loadIndex(table):
+    """Read the keys of table into the sorted index"""
+    cursor = table['cursor']
+    cursor.execute(table['selectKeys'])
+    table['index'] = sorted([str(row[0]) for row in cursor.fetchall()])
+    table['indexChecked'] = time.time()
+
+
+def nextKey(table, oid):
+    """Return the key following oid in the index, None at its end"""
+    if table['index'] is None:
+        loadIndex(table)
+    elif time.time() - table['indexChecked'] > moduleContext['indexRefresh']:
+        cursor = table['cursor']
+        cursor.execute(table['countKeys'])
+        if cursor.fetchone()[0] != len(table['index']):
+            loadIndex(table)
+        else:
+            table['indexChecked'] = time.time()
+
+    index = table['index']
+    i = bisect.bisect_right(index, table['toKey'](oid))
+    if i < len(index):
+        return index[i]
+
+
+def subtree(table, prefix):
+    """Return (oid, value) of the rows of table below prefix in OID order"""
+    if 'memory' in table:
+        return [(oid, row[memtable.VALUE])
+                for oid, row in table['memory'].subtree(prefix)]
+
+    key = table['toKey'](prefix)
+    cursor = table['cursor']
+    cursor.execute(table['selectSubtree'],
+                   (table['keyParam'](key),
+                    table['keyParam'](table['subtreeEnd'](key))))
+    rows = []
+    for key, value in cursor.fetchall():
+        if not table['structured']:
+            value = snmprecdb.split_mode(value)[1]
+        rows.append((table['fromKey'](str(key)), str(value)))
+    return rows
+
+
+def telemetryValue(table, oid, value):
+    """
+    Return the value of oid computed by the telemetry model, value if
+    telemetry is off or does not cover oid
+    """
+    if moduleContext['telemetry'] is None:
+        return value
+    computed = moduleContext['telemetry'].value(
+        oid, table['source'], lambda prefix: subtree(table, prefix))
+    if computed is None:
+        return value
+    return computed
+
+
+def getTable(value):
+    """
+    Return the table a record refers to, the value is <table> or
+    <table>@<database>. It is resolved once per record value.
+    """
+    tables = moduleContext['tables']
+    if value not in tables:
+        database = None
+        if value:
+            dbTable, _, database = value.split(',').pop(0).partition('@')
+        else:
+            dbTable = moduleContext['dbTable']
+        tables[value] = prepareTable(dbTable, database or None)
+    return tables[value]
+
+
+def readAhead(table, oid):
+    """
+    Return (key, tag, value) of the successor of oid from the read-ahead
+    window of table, refilled from oid when it does not cover it. None at
+    the end of the table.
+    """
+    key = table['toKey'](oid)
+    window = table['window']
+    if window and window['after'] <= key and \
+            time.time() - window['time'] <= moduleContext['readAheadAge']:
+        i = bisect.bisect_right(window['keys'], key)
+        if i < len(window['keys']):
+            return window['rows'][i]
+
+    cursor = table['cursor']
+    cursor.execute(table['selectWindow'], (table['keyParam'](key),))
+    rows = [(str(row[0]), row[1], row[2]) for row in cursor.fetchall()]
+    table['window'] = {'after': key,
+                       'keys': [row[0] for row in rows],
+                       'rows': rows,
+                       'time': time.time()}
+    if rows:
+        return rows[0]
+
+
+def dropReadAhead():
+    for table in moduleContext['tables'].values():
+        table['window'] = None
+
+
+def notified(kind, body):
+    """
+    The vPDU changed an OID, drop what may be stale. Runs on the thread of
+    the channel client.
+    """
+    with moduleContext['lock']:
+        dropReadAhead()
+        for memoryTable in moduleContext['memoryTables'].values():
+            memoryTable.refresh()
+
+
+def flush():
+    """Commit the pending SET PDUs"""
+    with moduleContext['lock']:
+        flusher = moduleContext['flusher']
+        if flusher:
+            flusher.cancel()
+            moduleContext['flusher'] = None
+
+        pending = moduleContext['pendingPdus']
+        if not pending:
+            return
+        snapshot()
+        for dbConn in moduleContext['pendingConns']:
+            dbConn.commit()
+        moduleContext['pendingConns'].clear()
+        # The vPDU reads the rows when it gets the informs
+        moduleContext['inform'].flush()
+        moduleContext['pendingPdus'] = 0
+        moduleContext['commits'] += 1
+        moduleContext['savedCommits'] += pending - 1
+        if moduleContext['groupCommit'] and \
+                moduleContext['commits'] % 1000 == 0:
+            logCommits()
+
+
+def logCommits():
+    log.msg('sql: %d commits, %d saved by group commit' %
+            (moduleContext['commits'], moduleContext['savedCommits']))
+
+
+def commitPdu():
+    """Commit a SET PDU, or leave it to the group commit"""
+    moduleContext['pendingPdus'] += 1
+    commitPdus = moduleContext['commitPdus']
+    if not moduleContext['groupCommit'] or \
+            (commitPdus and moduleContext['pendingPdus'] >= commitPdus):
+        flush()
+    elif not moduleContext['flusher']:
+        flusher = threading.Timer(moduleContext['commitInterval'], flush)
+        flusher.setDaemon(True)
+        flusher.start()
+        moduleContext['flusher'] = flusher
+
+
+def snapshot():
+    """Write the SETs on the tables held in memory back to the database"""
+    with moduleContext['lock']:
+        for memoryTable in moduleContext['memoryTables'].values():
+            try:
+                memoryTable.snapshot()
+            except Exception, ex:
+                log.msg('sql: snapshot of %s failed: %s' %
+                        (memoryTable.table, ex))
 
-    cursor = dbConn.cursor()
 
+def writeStats():
+    """Write the access statistics to the stats file"""
+    with moduleContext['lock']:
+        stats = moduleContext['stats'].snapshot()
+    if moduleContext.get('inform'):
+        stats['informs'] = moduleContext['inform'].counters()
     try:
-        cursor.execute(
-            'set session transaction isolation level %s' % moduleContext['isolationLevel']
-        )
-        cursor.fetchall()
-    except:  # non-MySQL/Postgres
-        pass
-
-    if value:
-        dbTable = value.split(',').pop(0)
-    elif 'dbTable' in moduleContext:
-        dbTable = moduleContext['dbTable']
+        oidstats.dump(stats, moduleContext['statsFile'])
+    except Exception, ex:
+        log.msg('sql: writing %s failed: %s' %
+                (moduleContext['statsFile'], ex))
+
+
+def statsLoop(stop):
+    while not stop.wait(moduleContext['statsInterval']):
+        writeStats()
+
+
+def processMemory(table, tag, context):
+    """Serve a varbind from a table held in memory"""
+    memoryTable = table['memory']
+    if moduleContext['channel'] is None or \
+            not moduleContext['channel'].connected:
+        # Without notifications of the vPDU look for changes every time
+        memoryTable.refresh()
+    origOid = context['origOid']
+    if context['setFlag']:
+        if 'hexvalue' in context:
+            textTag = context['hextag']
+            textValue = context['hexvalue']
+        else:
+            textTag = SnmprecGrammar().getTagByType(context['origValue'])
+            textValue = str(context['origValue'])
+        idx = max(0, context['varsTotal'] - context['varsRemaining'] - 1)
+        row = memoryTable.get(origOid)
+        if row is None:
+            raise Error.NoSuchInstanceError(name=origOid, idx=idx)
+        if row[memtable.MAXACCESS] != 'read-write':
+            return origOid, tag, context['errorStatus']
+
+        # if detected error mode, raise an error
+        mode = row[memtable.MODE]
+        if mode == 'error':
+            raise Error.WrongValueError(name=origOid, idx=idx)
+        elif mode not in (None, 'normal'):
+            return origOid, tag, context['errorStatus']
+
+        memoryTable.set(origOid, textTag, textValue)
+
+        if table['inform']:
+            # Sent when the SET is committed, queued and retried if the
+            # vPDU does not take it then
+            moduleContext['inform'].add(origOid, textValue, last=False)
+
+        return origOid, textTag, context['origValue']
     else:
-        log.msg('SQL table not specified for OID %s' % (context['origOid'],))
-        return context['origOid'], tag, context['errorStatus']
+        if context['nextFlag']:
+            record = memoryTable.get_next(origOid)
+            if record is None:
+                return origOid, tag, context['errorStatus']
+            origOid = origOid.clone(record[0])
+            row = record[1]
+        else:
+            row = memoryTable.get(origOid)
+            if row is None:
+                return origOid, tag, context['errorStatus']
+        return origOid, row[memtable.TAG], \
+            telemetryValue(table, origOid, row[memtable.VALUE])
+
+
+def variate(oid, tag, value, **context):
+    if 'dbConn' not in moduleContext:
+        raise error.SnmpsimError('variation module not initialized')
 
+    # The group commit timer shares the connection
+    with moduleContext['lock']:
+        start = time.time()
+        # snmpsimd gives up the rest of a PDU when a varbind raises
+        pduDone = True
+        try:
+            result = processVarBind(oid, tag, value, **context)
+            if context['setFlag']:
+                pduDone = context['varsRemaining'] == 0
+            return result
+        finally:
+            if context['setFlag'] and pduDone:
+                # Commit what the PDU set, also when it failed part way,
+                # so its transaction and informs are not held back
+                commitPdu()
+            stats = moduleContext['stats']
+            if stats is not None:
+                if context['setFlag']:
+                    operation = oidstats.SET
+                elif context['nextFlag']:
+                    operation = oidstats.GETNEXT
+                else:
+                    operation = oidstats.GET
+                stats.record(context['origOid'], operation,
+                             time.time() - start)
+
+
+def processVarBind(oid, tag, value, **context):
+    table = getTable(value)
+    if 'memory' in table:
+        return processMemory(table, tag, context)
+
+    cursor = table['cursor']
     origOid = context['origOid']
-    sqlOid = '.'.join(['%10s' % x for x in str(origOid).split('.')])
     if context['setFlag']:
         if 'hexvalue' in context:
             textTag = context['hextag']
@@ -105,9 +608,9 @@ def variate(oid, tag, value, **context):
         else:
             textTag = SnmprecGrammar().getTagByType(context['origValue'])
             textValue = str(context['origValue'])
-        cursor.execute(
-            'select maxaccess,tag,value from %s where oid=\'%s\' limit 1' % (dbTable, sqlOid)
-        )
+        idx = max(0, context['varsTotal'] - context['varsRemaining'] - 1)
+        key = keyParam(table, origOid)
+        cursor.execute(table['selectForSet'], (key,))
         resultset = cursor.fetchone()
         if resultset:
             maxaccess = resultset[0]
@@ -115,94 +618,97 @@ def variate(oid, tag, value, **context):
                 return origOid, tag, context['errorStatus']
 
             value_written = textValue
-            try:
-                value_settings = {}
-                value_settings = dict([split(x, '=') for x in split(resultset[2], ',')])
-                print value_settings
-                # if detected error mode, raise an error
-                if 'mode' in value_settings and \
-                        value_settings['mode'] == 'error':
-                    raise Error.WrongValueError(name=origOid,
-                                                idx=max(0,
-                                                        context['varsTotal'] - context['varsRemaining'] - 1))
-                elif 'mode' in value_settings and \
-                    value_settings['mode'] == 'normal':
-                    value_written = "mode=" + value_settings['mode'] + \
-                        ",value=" + textValue
-                else:
-                    return origOid, tag, context['errorStatus']
-            except Error.WrongValueError:
-                cursor.close()
-                raise Error.WrongValueError(name=origOid,
-                                           idx=max(0, context['varsTotal'] - context['varsRemaining'] - 1))
-            except:
-                pass
-
-            cursor.execute(
-                'update %s set tag=\'%s\',value=\'%s\' where oid=\'%s\'' %
-                (dbTable, textTag, value_written, sqlOid)
-            )
-
-            inform = moduleContext.get('inform')
-            try:
-                value = str(origOid) + " " + textValue
-                written_len = os.write(inform, value)
-                if written_len != len(value):
-                    log.msg("--->Infrasim: Expected length %d, actual length %d\n" % (len(str(origOid)), written_len))
-                    cursor.close()
-                    return origOid, tag, context['errorStatus']
-            except Exception, ex:
-                log.msg("--->Infrasim: {0}".format(ex))
-                cursor.close()
+            if table['structured']:
+                mode = resultset[3]
+            else:
+                mode, _ = snmprecdb.split_mode(resultset[2])
+
+            # if detected error mode, raise an error
+            if mode == 'error':
+                raise Error.WrongValueError(name=origOid, idx=idx)
+            elif mode == 'normal':
+                if not table['structured']:
+                    value_written = snmprecdb.join_mode(mode, textValue)
+            elif mode is not None:
                 return origOid, tag, context['errorStatus']
 
+            cursor.execute(table['update'], (textTag, value_written, key))
+            moduleContext['pendingConns'].add(table['conn'])
+            dropReadAhead()
+
+            if table['inform']:
+                # Sent when the SET is committed, queued and retried if the
+                # vPDU does not take it then
+                moduleContext['inform'].add(origOid, textValue, last=False)
+
         else:
-            cursor.close()
-            raise Error.NoSuchInstanceError(name=origOid,
-                   idx=max(0, context['varsTotal'] - context['varsRemaining'] - 1))
+            raise Error.NoSuchInstanceError(name=origOid, idx=idx)
 
-        if context['varsRemaining'] == 0:  # last OID in PDU
-            dbConn.commit()
-        cursor.close()
         return origOid, textTag, context['origValue']
     else:
-        if context['nextFlag']:
-            cursor.execute('select oid from %s where oid>\'%s\' order by oid limit 1' % (dbTable, sqlOid))
-            resultset = cursor.fetchone()
+        if context['nextFlag'] and moduleContext['readAhead'] > 0:
+            resultset = readAhead(table, origOid)
             if resultset:
-                origOid = origOid.clone(
-                  '.'.join([x.strip() for x in str(resultset[0]).split('.')])
-                )
-                sqlOid = '.'.join(['%10s' % x for x in str(origOid).split('.')])
-            else:
-                cursor.close()
-                return origOid, tag, context['errorStatus']
-
-        cursor.execute('select tag, value from %s where oid=\'%s\' limit 1' % (dbTable, sqlOid))
-        resultset = cursor.fetchone()
-        cursor.close()
+                origOid = origOid.clone(table['fromKey'](resultset[0]))
+                resultset = resultset[1:]
+        elif context['nextFlag']:
+            key = nextKey(table, origOid)
+            resultset = None
+            if key is not None:
+                cursor.execute(table['select'], (table['keyParam'](key),))
+                resultset = cursor.fetchone()
+                if resultset is None:
+                    # The row was deleted, let the database find the next one
+                    loadIndex(table)
+                    cursor.execute(table['selectNext'],
+                                   (keyParam(table, origOid),))
+                    resultset = cursor.fetchone()
+                    if resultset:
+                        key = str(resultset[0])
+                        resultset = resultset[1:]
+            if resultset:
+                origOid = origOid.clone(table['fromKey'](key))
+        else:
+            cursor.execute(table['select'], (keyParam(table, origOid),))
+            resultset = cursor.fetchone()
 
         if resultset:
-            try:
-                value_settings = {}
-                value_settings = \
-                    dict([split(x, '=') for x in split(resultset[1], ',')])
-                print value_settings
-                if 'mode' in value_settings:
-                    return origOid, str(resultset[0]), str(value_settings['value'])
-            except:
-                pass
-            return origOid, str(resultset[0]), str(resultset[1])
+            value = resultset[1]
+            if not table['structured']:
+                value = snmprecdb.split_mode(value)[1]
+            return origOid, str(resultset[0]), \
+                telemetryValue(table, origOid, str(value))
         else:
             return origOid, tag, context['errorStatus']
 
+
 def shutdown(**context):
-    dbConn = moduleContext.get('dbConn')
-    if dbConn:
-        if 'mode' in context and context['mode'] == 'recording':
-            dbConn.commit()
-        dbConn.close()
+    if moduleContext.get('statsWriter'):
+        statsWriter, stop = moduleContext['statsWriter']
+        stop.set()
+        statsWriter.join()
+        writeStats()
+
+    if moduleContext.get('dbConn'):
+        flush()
+        # Keep what a PDU which did not complete set in memory
+        snapshot()
+        if moduleContext['groupCommit']:
+            logCommits()
+        for database in moduleContext['databases'].values():
+            database['cursor'].close()
+            if 'mode' in context and context['mode'] == 'recording':
+                database['conn'].commit()
+            database['conn'].close()
+        moduleContext['databases'].clear()
 
     inform = moduleContext.get('inform')
     if inform:
-        os.close(inform)
+        inform.close()
+        log.msg('sql: informs %(sent)d sent, %(retries)d retries, '
+                '%(coalesced)d coalesced, %(dropped)d dropped, '
+                '%(resent)d resent, %(queued)d not delivered, '
+                '%(unacked)d not acknowledged' % inform.counters())
+
+    if moduleContext.get('channel'):
+        moduleContext['channel'].close()